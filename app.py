@@ -6,6 +6,8 @@ import streamlit as st
 import cv2
 import numpy as np
 from PIL import Image
+import gc
+import hashlib
 import io
 import os
 import sys
@@ -17,6 +19,12 @@ import plotly.graph_objects as go
 sys.path.insert(0, str(Path(__file__).parent))
 from modules import GraphExtractor
 from modules.data_types import AxisCalibration
+from modules.exporter import DataExporter
+
+SCATTERGL_MIN_POINTS = 1000
+LTTB_MIN_POINTS = 3000
+LTTB_TARGET_POINTS = 2000
+EXTRACTION_CACHE_ENTRIES = 8
 
 st.set_page_config(
     page_title="Data From Plot",
@@ -39,12 +47,79 @@ st.markdown("""
 
 
 def save_uploaded_file(uploaded_file):
-    """Salva arquivo temporário"""
+    """Salva arquivo temporário (aceita UploadedFile ou bytes)"""
+    data = uploaded_file if isinstance(uploaded_file, bytes) else uploaded_file.getvalue()
     with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp_file:
-        tmp_file.write(uploaded_file.getvalue())
+        tmp_file.write(data)
         return tmp_file.name
 
 
+@st.cache_data(show_spinner=False, max_entries=EXTRACTION_CACHE_ENTRIES)
+def run_extraction(file_bytes: bytes, grid_size: int, legend_boxes: tuple = ()) -> dict:
+    """
+    Executa o pipeline completo, memoizado pelo conteúdo da imagem e parâmetros
+    
+    Reruns do Streamlit (filtros, calibração manual) reaproveitam o resultado
+    sem reprocessar. Retorna apenas estado serializável (sem o extrator).
+    """
+    temp_path = save_uploaded_file(file_bytes)
+    extractor = None
+    try:
+        extractor = GraphExtractor(temp_path, grid_divisions=grid_size, remove_legends=False)
+        if legend_boxes:
+            extractor.remove_detected_legends(list(legend_boxes))
+        extractor.process()
+        
+        ok, vis_png = cv2.imencode('.png', extractor.visualize())
+        state = {
+            'frame': extractor.frame,
+            'x_calibration': extractor.x_calibration,
+            'y_calibration': extractor.y_calibration,
+            'data_points': extractor.data_points,
+            'visualization_png': vis_png.tobytes() if ok else b''
+        }
+    finally:
+        os.unlink(temp_path)
+        # Imagens (original, sem legendas) não entram no cache: liberar já
+        del extractor
+        gc.collect()
+    
+    return state
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int = LTTB_TARGET_POINTS) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: índices de n_out pontos visualmente representativos
+    
+    Espera x ordenado. O primeiro e o último ponto são sempre mantidos; de cada
+    bucket intermediário fica o ponto que forma o maior triângulo com o ponto
+    escolhido no bucket anterior e a média do bucket seguinte.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        
+        if i + 2 < len(edges):
+            next_lo, next_hi = edges[i + 1], edges[i + 2]
+            avg_x, avg_y = x[next_lo:next_hi].mean(), y[next_lo:next_hi].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        idx[i + 1] = a
+    
+    return idx
+
+
 def plot_series(data_points, x_calib, y_calib):
     """Cria gráficos interativos com Plotly"""
     color_map = {
@@ -55,31 +130,50 @@ def plot_series(data_points, x_calib, y_calib):
     
     figs = []
     
-    for color, points in data_points.items():
-        if not points:
+    for color, df in data_points.items():
+        if df.empty:
             continue
         
-        df = pd.DataFrame(points).sort_values('x')
+        xs = df['x'].to_numpy(dtype=np.float64)
+        ys = df['y'].to_numpy(dtype=np.float64)
+        
+        # Séries já vêm ordenadas por x do extrator; só ordena se o invariante quebrou
+        order = None
+        if not df['x'].is_monotonic_increasing:
+            order = np.argsort(xs, kind='stable')
+            xs, ys = xs[order], ys[order]
+        
+        preview = df.head(10) if order is None else df.iloc[order[:10]]
+        
+        # Decimação só para o gráfico; df completo segue para exportação
+        if len(xs) > LTTB_MIN_POINTS:
+            keep = lttb(xs, ys)
+            xs, ys = xs[keep], ys[keep]
+        
+        # WebGL para séries densas (SVG fica lento acima de ~1000 pontos)
+        trace_cls = go.Scattergl if len(df) >= SCATTERGL_MIN_POINTS else go.Scatter
         
         fig = go.Figure()
-        fig.add_trace(go.Scatter(
-            x=df['x'],
-            y=df['y'],
+        fig.add_trace(trace_cls(
+            x=xs,
+            y=ys,
             mode='lines+markers',
             name=color,
-            line=dict(color=color_map.get(color, '#000000'), width=2),
+            # Chave da série é '<Cor>_<tipo>' (ex: 'Red_points'): o mapa usa só a cor
+            line=dict(color=color_map.get(color.split('_', 1)[0], '#000000'), width=2),
             marker=dict(size=6)
         ))
         
         fig.update_layout(
-            title=f'{color} - {len(points)} pontos',
+            title=f'{color} - {len(df)} pontos',
             xaxis_title=f'X ({x_calib.min_value:.1f} a {x_calib.max_value:.1f})',
             yaxis_title=f'Y ({y_calib.min_value:.1f} a {y_calib.max_value:.1f})',
             height=400,
-            showlegend=True
+            showlegend=True,
+            uirevision=color
         )
         
-        figs.append((color, fig, df))
+        figs.append((color, fig, preview, len(df)))
     
     return figs
 
@@ -135,8 +229,10 @@ def main():
     # Inicializar session state
     if 'processed' not in st.session_state:
         st.session_state.processed = False
-    if 'extractor' not in st.session_state:
-        st.session_state.extractor = None
+    if 'kept_series' not in st.session_state:
+        st.session_state.kept_series = None  # None = todas as séries
+    if 'kept_series_key' not in st.session_state:
+        st.session_state.kept_series_key = None  # (hash da imagem, grid) da seleção
     if 'legend_step' not in st.session_state:
         st.session_state.legend_step = 'upload'  # upload -> detect -> confirm -> process
     if 'detected_boxes' not in st.session_state:
@@ -192,7 +288,8 @@ def main():
                         if boxes:
                             st.success(f"✓ Detectadas {len(boxes)} legendas!")
                             st.session_state.legend_step = 'confirm'
-                            st.session_state.legend_vis = vis
+                            # PNG codificado uma vez; st.image usa os bytes sem reconverter
+                            st.session_state.legend_vis = cv2.imencode('.png', vis)[1].tobytes()
                             st.rerun()
                         else:
                             st.info("✅ Nenhuma legenda interna detectada!")
@@ -209,8 +306,7 @@ def main():
             # Mostrar visualização
             with col2:
                 st.subheader("Legendas Detectadas")
-                vis_rgb = cv2.cvtColor(st.session_state.legend_vis, cv2.COLOR_BGR2RGB)
-                st.image(vis_rgb, caption="Caixas vermelhas = legendas detectadas", use_container_width=True)
+                st.image(st.session_state.legend_vis, caption="Caixas vermelhas = legendas detectadas", use_container_width=True)
             
             st.markdown("**O que deseja fazer?**")
             
@@ -220,12 +316,14 @@ def main():
                 if st.button("✅ Remover Legendas", type="primary", use_container_width=True):
                     st.session_state.legend_step = 'process'
                     st.session_state.remove_legends = True
+                    st.session_state.pop('legend_vis', None)
                     st.rerun()
             
             with col_b:
                 if st.button("❌ Manter Legendas", use_container_width=True):
                     st.session_state.legend_step = 'process'
                     st.session_state.remove_legends = False
+                    st.session_state.pop('legend_vis', None)
                     st.rerun()
         
         elif st.session_state.legend_step == 'process':
@@ -234,64 +332,62 @@ def main():
             
             with st.spinner("Processando gráfico..."):
                 try:
-                    # Criar extrator
                     remove_legends_flag = st.session_state.get('remove_legends', False)
+                    legend_boxes = ()
                     
                     if remove_legends_flag:
                         st.info("🧹 Removendo legendas detectadas...")
-                        extractor = GraphExtractor(temp_path, grid_divisions=grid_size, remove_legends=False)
-                        extractor.remove_detected_legends(st.session_state.detected_boxes)
-                    else:
-                        extractor = GraphExtractor(temp_path, grid_divisions=grid_size, remove_legends=False)
+                        legend_boxes = tuple(tuple(int(v) for v in box) for box in st.session_state.detected_boxes)
                     
-                    # Processar
+                    # Processar (cacheado por conteúdo da imagem + parâmetros)
                     with st.expander("📋 Log de Processamento", expanded=False):
-                        data = extractor.process()
+                        file_bytes = uploaded_file.getvalue()
+                        state = run_extraction(file_bytes, grid_size, legend_boxes)
+                    
+                    x_calibration = state['x_calibration']
+                    y_calibration = state['y_calibration']
+                    data_points = state['data_points']
+                    
+                    # A seleção de séries vale só para a imagem/grid em que foi feita
+                    selection_key = (hashlib.md5(file_bytes).hexdigest(), grid_size)
+                    if st.session_state.kept_series_key != selection_key:
+                        st.session_state.kept_series = None
+                        st.session_state.kept_series_key = selection_key
+                    
+                    if st.session_state.kept_series is not None:
+                        data_points = {k: v for k, v in data_points.items() if k in st.session_state.kept_series}
                     
-                    # Aplicar calibração manual se habilitada
+                    # Aplicar calibração manual se habilitada (fora do cache)
                     if manual_calib:
-                        extractor.x_calibration = AxisCalibration(
+                        x_calibration = AxisCalibration(
                             manual_calib['x_min'], 
                             manual_calib['x_max']
                         )
-                        extractor.y_calibration = AxisCalibration(
+                        y_calibration = AxisCalibration(
                             manual_calib['y_min'], 
                             manual_calib['y_max']
                         )
                         
-                        # Recalcular pontos
-                        for color_key in list(extractor.data_points.keys()):
-                            points = extractor.data_points[color_key]
-                            new_points = []
-                            
-                            for pt in points:
-                                norm_x = pt['x']
-                                norm_y = pt['y']
-                                
-                                real_x = manual_calib['x_min'] + norm_x * (manual_calib['x_max'] - manual_calib['x_min'])
-                                real_y = manual_calib['y_min'] + norm_y * (manual_calib['y_max'] - manual_calib['y_min'])
-                                
-                                new_points.append({
-                                    'x': real_x,
-                                    'y': real_y,
-                                    'type': pt['type']
-                                })
-                            
-                            extractor.data_points[color_key] = new_points
+                        # Recalcular pontos (vetorizado por série)
+                        x_span = manual_calib['x_max'] - manual_calib['x_min']
+                        y_span = manual_calib['y_max'] - manual_calib['y_min']
+                        
+                        for color_key, points in data_points.items():
+                            data_points[color_key] = points.assign(
+                                x=manual_calib['x_min'] + points['x'].to_numpy() * x_span,
+                                y=manual_calib['y_min'] + points['y'].to_numpy() * y_span
+                            )
                         
                         st.success(f"✅ Calibração manual: X[{manual_calib['x_min']}, {manual_calib['x_max']}], Y[{manual_calib['y_min']}, {manual_calib['y_max']}]")
                     
-                    st.session_state.extractor = extractor
                     st.session_state.processed = True
                     
                     # Resumo
-                    summary = extractor.get_summary()
-                    
                     col_a, col_b, col_c = st.columns(3)
                     with col_a:
-                        st.metric("Séries Detectadas", summary['total_series'])
+                        st.metric("Séries Detectadas", len(data_points))
                     with col_b:
-                        st.metric("Total de Pontos", summary['total_points'])
+                        st.metric("Total de Pontos", sum(len(pts) for pts in data_points.values()))
                     with col_c:
                         st.metric("Calibração", "Manual" if manual_calib else "Automática")
                     
@@ -301,47 +397,47 @@ def main():
                     st.session_state.processed = False
             
             # Visualização
-            if st.session_state.processed and st.session_state.extractor:
-                extractor = st.session_state.extractor
+            if st.session_state.processed:
+                exporter = DataExporter(
+                    uploaded_file.name, state['frame'],
+                    x_calibration, y_calibration, data_points
+                )
                 
                 with col2:
                     st.subheader("Detecção de Pontos")
-                    vis_path = os.path.join(tempfile.gettempdir(), 'visualization.png')
-                    vis = extractor.visualize(vis_path)
-                    vis_rgb = cv2.cvtColor(vis, cv2.COLOR_BGR2RGB)
-                    st.image(vis_rgb, caption="Pontos detectados", use_container_width=True)
+                    st.image(state['visualization_png'], caption="Pontos detectados", use_container_width=True)
                 
                 # Gráficos interativos
                 st.header("📊 4. Gráficos Extraídos")
                 
                 with st.expander("🎯 Filtrar Séries", expanded=False):
-                    available_series = list(extractor.data_points.keys())
+                    available_series = list(state['data_points'].keys())
                     if available_series:
+                        kept = st.session_state.kept_series
+                        # None = todas; lista vazia é uma seleção explícita e é mantida
+                        if kept is None:
+                            default_series = available_series
+                        else:
+                            default_series = [name for name in kept if name in available_series]
                         series_to_keep = st.multiselect(
                             "Selecione as séries para manter:",
                             options=available_series,
-                            default=available_series,
-                            key="series_filter"
+                            default=default_series,
+                            key="series_filter_%s_%d" % selection_key
                         )
                         
                         if st.button("Aplicar Filtro", key="apply_filter"):
-                            for series in list(extractor.data_points.keys()):
-                                if series not in series_to_keep:
-                                    del extractor.data_points[series]
+                            st.session_state.kept_series = list(series_to_keep)
                             st.success(f"✅ {len(series_to_keep)} série(s) mantida(s)")
                             st.rerun()
                 
-                figs = plot_series(
-                    extractor.data_points,
-                    extractor.x_calibration,
-                    extractor.y_calibration
-                )
+                figs = plot_series(data_points, x_calibration, y_calibration)
                 
                 if figs:
-                    for color, fig, df in figs:
-                        with st.expander(f"📈 {color} ({len(df)} pontos)", expanded=True):
+                    for color, fig, preview, n_points in figs:
+                        with st.expander(f"📈 {color} ({n_points} pontos)", expanded=True):
                             st.plotly_chart(fig, use_container_width=True)
-                            st.dataframe(df.head(10), use_container_width=True)
+                            st.dataframe(preview, use_container_width=True)
                 else:
                     st.warning("⚠️ Nenhum ponto detectado")
                 
@@ -353,51 +449,49 @@ def main():
                 with col_x:
                     if st.button("📊 Exportar Excel", use_container_width=True, key="export_excel_btn"):
                         try:
-                            excel_path = os.path.join(tempfile.gettempdir(), 'graph_data.xlsx')
-                            extractor.export_excel(excel_path)
+                            # Gerado em memória, sem ida e volta pelo disco
+                            excel_buf = io.BytesIO()
+                            exporter.to_excel(excel_buf, with_charts=True)
                             
-                            with open(excel_path, 'rb') as f:
-                                st.download_button(
-                                    label="⬇️ Download Excel",
-                                    data=f,
-                                    file_name='graph_data.xlsx',
-                                    mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                                    use_container_width=True,
-                                    key="download_excel_btn"
-                                )
+                            st.download_button(
+                                label="⬇️ Download Excel",
+                                data=excel_buf.getvalue(),
+                                file_name='graph_data.xlsx',
+                                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                                use_container_width=True,
+                                key="download_excel_btn"
+                            )
                         except Exception as e:
                             st.error(f"Erro: {e}")
                 
                 with col_y:
                     if st.button("📄 Exportar CSV", use_container_width=True, key="export_csv_btn"):
                         try:
-                            csv_path = os.path.join(tempfile.gettempdir(), 'graph_data.csv')
-                            extractor.export_csv(csv_path)
+                            csv_buf = io.StringIO()
+                            exporter.to_csv(csv_buf)
                             
-                            with open(csv_path, 'r', encoding='utf-8') as f:
-                                st.download_button(
-                                    label="⬇️ Download CSV",
-                                    data=f,
-                                    file_name='graph_data.csv',
-                                    mime='text/csv',
-                                    use_container_width=True,
-                                    key="download_csv_btn"
-                                )
+                            st.download_button(
+                                label="⬇️ Download CSV",
+                                data=csv_buf.getvalue(),
+                                file_name='graph_data.csv',
+                                mime='text/csv',
+                                use_container_width=True,
+                                key="download_csv_btn"
+                            )
                         except Exception as e:
                             st.error(f"Erro: {e}")
                 
                 with col_z:
                     if st.button("🖼️ Exportar Visualização", use_container_width=True, key="export_vis_btn"):
                         try:
-                            with open(vis_path, 'rb') as f:
-                                st.download_button(
-                                    label="⬇️ Download PNG",
-                                    data=f,
-                                    file_name='visualization.png',
-                                    mime='image/png',
-                                    use_container_width=True,
-                                    key="download_vis_btn"
-                                )
+                            st.download_button(
+                                label="⬇️ Download PNG",
+                                data=state['visualization_png'],
+                                file_name='visualization.png',
+                                mime='image/png',
+                                use_container_width=True,
+                                key="download_vis_btn"
+                            )
                         except Exception as e:
                             st.error(f"Erro: {e}")
     
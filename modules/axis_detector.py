@@ -13,9 +13,10 @@ except ImportError:
 class AxisDetector:
     """Detecta eixos do gráfico de forma robusta"""
     
-    def __init__(self, img: np.ndarray):
+    def __init__(self, img: np.ndarray, gray: Optional[np.ndarray] = None):
         self.img = img
-        self.gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        # Escala de cinza pode vir pronta do extrator (compartilhada entre etapas)
+        self.gray = gray if gray is not None else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         self.h, self.w = img.shape[:2]
     
     def detect_axes(self) -> List[GraphAxis]:
@@ -28,10 +29,9 @@ class AxisDetector:
         if lines1 is not None:
             all_lines.extend(lines1)
         
-        # Estratégia 2: Morfologia para preencher gaps
+        # Estratégia 2: Morfologia para preencher gaps (fechamento = dilate + erode)
         kernel = np.ones((3, 3), np.uint8)
-        edges2 = cv2.dilate(edges1, kernel, iterations=2)
-        edges2 = cv2.erode(edges2, kernel, iterations=2)
+        edges2 = cv2.morphologyEx(edges1, cv2.MORPH_CLOSE, kernel, iterations=2)
         lines2 = cv2.HoughLinesP(edges2, 1, np.pi/180, 80, minLineLength=80, maxLineGap=20)
         if lines2 is not None:
             all_lines.extend(lines2)
@@ -59,20 +59,21 @@ class AxisDetector:
     
     def _categorize_lines(self, lines: List) -> tuple:
         """Categoriza linhas em horizontais e verticais"""
-        h_lines, v_lines = [], []
+        arr = np.asarray(lines).reshape(-1, 4)
+        dx = (arr[:, 2] - arr[:, 0]).astype(np.int64)
+        dy = (arr[:, 3] - arr[:, 1]).astype(np.int64)
+        angle = np.abs(np.degrees(np.arctan2(dy, dx)))
+        # Comprimento ao quadrado (inteiro exato): compara com o limite ao quadrado, sem sqrt
+        length_sq = dx * dx + dy * dy
         
-        for line in lines:
-            x1, y1, x2, y2 = line[0]
-            angle = np.abs(np.degrees(np.arctan2(y2 - y1, x2 - x1)))
-            length = np.sqrt((x2 - x1)**2 + (y2 - y1)**2)
-            
-            # Linhas horizontais
-            if (angle < 5 or angle > 175) and length > 0.5 * self.w:
-                h_lines.append(GraphAxis(x1, y1, x2, y2, True))
-            
-            # Linhas verticais
-            elif 85 < angle < 95 and length > 0.5 * self.h:
-                v_lines.append(GraphAxis(x1, y1, x2, y2, False))
+        # Linhas horizontais
+        h_mask = ((angle < 5) | (angle > 175)) & (length_sq > (0.5 * self.w) ** 2)
+        
+        # Linhas verticais (exclusivas das horizontais, como no elif original)
+        v_mask = ~h_mask & (angle > 85) & (angle < 95) & (length_sq > (0.5 * self.h) ** 2)
+        
+        h_lines = [GraphAxis(x1, y1, x2, y2, True) for x1, y1, x2, y2 in arr[h_mask].tolist()]
+        v_lines = [GraphAxis(x1, y1, x2, y2, False) for x1, y1, x2, y2 in arr[v_mask].tolist()]
         
         return h_lines, v_lines
     
@@ -81,30 +82,33 @@ class AxisDetector:
         if not axes:
             return []
         
-        # Ordenar por posição
+        # Posição e comprimento de todos os eixos de uma vez
+        arr = np.array([(a.x1, a.y1, a.x2, a.y2) for a in axes], dtype=np.float64)
         if is_horizontal:
-            axes.sort(key=lambda a: (a.y1 + a.y2) / 2)
+            pos = (arr[:, 1] + arr[:, 3]) / 2
         else:
-            axes.sort(key=lambda a: (a.x1 + a.x2) / 2)
-        
-        merged = [axes[0]]
-        
-        for axis in axes[1:]:
-            last = merged[-1]
-            
-            if is_horizontal:
-                dist = abs((axis.y1 + axis.y2) / 2 - (last.y1 + last.y2) / 2)
-            else:
-                dist = abs((axis.x1 + axis.x2) / 2 - (last.x1 + last.x2) / 2)
-            
-            if dist < threshold:
+            pos = (arr[:, 0] + arr[:, 2]) / 2
+        # Só a ordem dos comprimentos importa: o quadrado basta
+        d = arr[:, 2:] - arr[:, :2]
+        lengths = (d * d).sum(axis=1)
+        
+        # Ordenar por posição (estável, como list.sort)
+        order = np.argsort(pos, kind='stable')
+        pos = pos[order].tolist()
+        lengths = lengths[order].tolist()
+        
+        # Varredura em escalares: compara com o representante atual do grupo
+        kept = [0]
+        for i in range(1, len(pos)):
+            last = kept[-1]
+            if abs(pos[i] - pos[last]) < threshold:
                 # Mesclar (usar o mais longo)
-                if axis.length() > last.length():
-                    merged[-1] = axis
+                if lengths[i] > lengths[last]:
+                    kept[-1] = i
             else:
-                merged.append(axis)
+                kept.append(i)
         
-        return merged
+        return [axes[order[i]] for i in kept]
     
     def _use_image_borders(self) -> List[GraphAxis]:
         """Fallback: usa as bordas da imagem como eixos"""
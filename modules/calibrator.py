@@ -4,26 +4,233 @@ Combina:
 - Multi-threshold OCR da versão nova
 - Simplicidade e ROIs da versão antiga
 - Filtros inteligentes de números
+
+OCR: usa a API in-process do tesserocr quando instalada (sem fork de
+subprocesso nem recarga do tessdata a cada chamada); caso contrário,
+cai para o pytesseract.
 """
 import cv2
+import hashlib
+import importlib.util
+import math
 import numpy as np
+import os
 import pytesseract
 import re
-from typing import List
-from PIL import Image, ImageEnhance
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 try:
     from .data_types import GraphFrame, AxisCalibration
 except ImportError:
     from data_types import GraphFrame, AxisCalibration
 
+# Backend in-process: eixos são calibrados em paralelo, então cada instância do
+# Tesseract fica em 1 thread. O OpenMP só lê OMP_THREAD_LIMIT ao carregar a
+# biblioteca, por isso o limite é definido logo antes do import, e só quando o
+# tesserocr está instalado (um valor já definido no ambiente é respeitado)
+tesserocr = None
+if importlib.util.find_spec('tesserocr') is not None:
+    _omp_preset = 'OMP_THREAD_LIMIT' in os.environ
+    os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+    try:
+        import tesserocr
+    except (ImportError, ValueError):
+        # ValueError: o cysignals do tesserocr só instala handlers de sinal na
+        # thread principal (o Streamlit executa o script em outra thread)
+        tesserocr = None
+        if not _omp_preset:
+            del os.environ['OMP_THREAD_LIMIT']
+
+
+# Caracteres aceitos pelo OCR (rótulos numéricos)
+_OCR_WHITELIST = '0123456789.,-'
+
+# Instâncias do tesserocr por thread e PSM (a API não é thread-safe;
+# inicializar carrega o tessdata: fazer uma vez só por thread)
+_tess_local = threading.local()
+
+# Rascunho por thread: buffer do mosaico de OCR (evita alocar a cada ROI) e CLAHE
+_scratch = threading.local()
+
+# Pool persistente: as threads (e suas APIs do tesserocr) sobrevivem entre imagens
+_axis_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='axis-ocr')
+
+# Cache LRU dos resultados do OCR (chave: hash do conteúdo + config)
+_OCR_CACHE_SIZE = 128
+_ocr_cache: "OrderedDict[tuple, List[float]]" = OrderedDict()
+_ocr_cache_lock = threading.Lock()
+
+# Cache LRU do resultado final por ROI (lotes do mesmo layout repetem os rótulos)
+_ROI_CACHE_SIZE = 32
+_roi_cache: "OrderedDict[tuple, List[float]]" = OrderedDict()
+_roi_cache_lock = threading.Lock()
+
+# ROIs estreitas são ampliadas uma única vez antes das estratégias de OCR
+_OCR_MIN_WIDTH = 400
+_OCR_TARGET_WIDTH = 600
+
+# Faixa branca entre variantes no mosaico de OCR
+_MOSAIC_GAP = 20
+
+# CLAHE da estratégia 5 (equalização local: lida com fundos irregulares e grid)
+_CLAHE_CLIP_LIMIT = 3.0
+_CLAHE_TILE_GRID = (8, 8)
+
+# Fração mínima de pixels de cada cor para uma variante não ser considerada em branco
+_BLANK_FRACTION = 0.002
+
+# Casas decimais consideradas ao deduplicar leituras das várias estratégias
+_DEDUPE_DECIMALS = 4
+
+# Acima deste tamanho o IQR usa _quantiles_partition (np.partition); abaixo, sorted()
+_IQR_NUMPY_MIN = 64
+
+# Números no texto OCR: decimais primeiro, depois inteiros (anos caem na regra de inteiros)
+_NUM_RE = re.compile(r'-?\d+[.,]\d+|-?\d+')
+
+# Espaços que o OCR insere dentro de um número; os demais separam rótulos vizinhos
+# na mesma linha ("0 2 4 6 8 10"). Sinal só é colado sem dígito logo antes ("- 5",
+# mas "5 - 3" são dois rótulos); ponto decimal nos dois lados ("0. 5", "0 .5");
+# vírgula seguida de espaço separa rótulos ("10, 20")
+_INNER_SPACE_RE = re.compile(
+    r'(?<![\d.,]-)(?<![\d.,][ \t]-)(?<=-)[ \t]+(?=\d)'
+    r'|(?<=\d\.)[ \t]+(?=\d)'
+    r'|(?<=\d)[ \t]+(?=[.,]\d)'
+)
+
+# Milhar separado por espaço ("1 000"): só quando o número está sozinho na linha
+# (rótulos do eixo Y); numa linha de rótulos do X, "80 100" seria ambíguo
+_WS_RE = re.compile(r'[ \t]+')
+_THOUSANDS_LINE_RE = re.compile(r'^([^\d\n]*[1-9]\d{0,2})((?:[ \t]\d{3})+)(?=[^\d\n]*$)', re.M)
+
+
+def _tesserocr_api(psm: int):
+    """Retorna a API do tesserocr para o PSM dado, ou None se indisponível"""
+    global tesserocr
+    if tesserocr is None:
+        return None
+    
+    apis = getattr(_tess_local, 'apis', None)
+    if apis is None:
+        apis = _tess_local.apis = {}
+    
+    api = apis.get(psm)
+    if api is None:
+        try:
+            api = tesserocr.PyTessBaseAPI(psm=psm, oem=tesserocr.OEM.DEFAULT)
+        except RuntimeError:
+            # tessdata não encontrado: desabilita e usa o pytesseract
+            tesserocr = None
+            return None
+        api.SetVariable('tessedit_char_whitelist', _OCR_WHITELIST)
+        apis[psm] = api
+    
+    return api
+
+
+def _image_to_string(img: np.ndarray, psm: int) -> str:
+    """OCR de um ndarray (cinza ou BGR): tesserocr in-process, ou subprocesso do pytesseract"""
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    
+    api = _tesserocr_api(psm)
+    if api is not None:
+        # Buffer cru direto para o Tesseract, sem montar uma imagem PIL
+        img = np.ascontiguousarray(img)
+        h, w = img.shape[:2]
+        bpp = 1 if img.ndim == 2 else img.shape[2]
+        api.SetImageBytes(img.tobytes(), w, h, bpp, w * bpp)
+        return api.GetUTF8Text()
+    
+    return pytesseract.image_to_string(
+        img,
+        config=f'--psm {psm} --oem 3 -c tessedit_char_whitelist={_OCR_WHITELIST}'
+    )
+
+
+def _log(msg: str):
+    """print() das calibrações; dentro de calibrate_axes vai para o buffer do eixo"""
+    buf = getattr(_scratch, 'log', None)
+    if buf is None:
+        print(msg)
+    else:
+        buf.append(msg)
+
+
+def _run_buffered(fn):
+    """Executa fn guardando as mensagens de _log desta thread; retorna (resultado, mensagens)"""
+    _scratch.log = []
+    try:
+        return fn(), _scratch.log
+    finally:
+        _scratch.log = None
+
+
+def _quantiles_partition(arr: np.ndarray, qs: Tuple[float, ...]) -> List[float]:
+    """
+    Quantis com interpolação linear (como np.percentile) via np.partition:
+    seleção O(n) apenas das posições vizinhas, sem ordenar o array inteiro
+    """
+    n = len(arr)
+    positions = [q * (n - 1) for q in qs]
+    neighbors = sorted({min(int(p) + k, n - 1) for p in positions for k in (0, 1)})
+    part = np.partition(arr, neighbors)
+    
+    result = []
+    for p in positions:
+        lo = int(p)
+        hi = min(lo + 1, n - 1)
+        result.append(float(part[lo] + (part[hi] - part[lo]) * (p - lo)))
+    return result
+
+
+def _mosaic_buffer(height: int, width: int) -> np.ndarray:
+    """View (height, width) sobre o buffer de rascunho da thread, que cresce sob demanda"""
+    size = height * width
+    buf = getattr(_scratch, 'mosaic', None)
+    if buf is None or buf.size < size:
+        buf = _scratch.mosaic = np.empty(size, dtype=np.uint8)
+    return buf[:size].reshape(height, width)
+
+
+def _quantile_sorted(ordered: List[float], q: float) -> float:
+    """Quantil com interpolação linear (mesmo método padrão do np.percentile)"""
+    pos = q * (len(ordered) - 1)
+    lo = int(pos)
+    if lo + 1 >= len(ordered):
+        return ordered[-1]
+    return ordered[lo] + (ordered[lo + 1] - ordered[lo]) * (pos - lo)
+
 
 class AxisCalibratorV3:
     """Calibrador híbrido com OCR robusto"""
     
-    def __init__(self, img: np.ndarray, frame: GraphFrame):
+    def __init__(self, img: np.ndarray, frame: GraphFrame, gray: Optional[np.ndarray] = None):
         self.img = img
         self.frame = frame
         self.h, self.w = img.shape[:2]
+        # ROIs são fatiadas da escala de cinza da imagem inteira (convertida uma vez)
+        if gray is None:
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+        self.gray = gray
+    
+    def calibrate_axes(self) -> Tuple[AxisCalibration, AxisCalibration]:
+        """
+        Calibra X e Y em paralelo
+        O OCR roda fora do GIL (tesserocr ou subprocesso), então as duas ROIs
+        são independentes e o tempo total cai para o do eixo mais lento
+        """
+        x_future = _axis_pool.submit(_run_buffered, self.calibrate_x_axis)
+        y_future = _axis_pool.submit(_run_buffered, self.calibrate_y_axis)
+        (x_calib, x_log), (y_calib, y_log) = x_future.result(), y_future.result()
+        
+        # Mensagens de cada eixo impressas juntas, sem intercalar as duas threads
+        for msg in x_log + y_log:
+            print(msg)
+        
+        return x_calib, y_calib
     
     def calibrate_x_axis(self) -> AxisCalibration:
         """Calibra eixo X com OCR multi-estratégia"""
@@ -35,7 +242,7 @@ class AxisCalibratorV3:
             margin_v = 150  # Altura da faixa
             margin_h = 30   # Margem lateral
             
-            roi = self.img[
+            roi = self.gray[
                 y2:min(y2 + margin_v, self.h),
                 max(0, x1 - margin_h):min(x2 + margin_h, self.w)
             ]
@@ -63,13 +270,13 @@ class AxisCalibratorV3:
                     elif is_symmetric:
                         zero_pos = 0.5  # Centro
                 
-                print(f"  ✓ Eixo X: {numbers} → [{min_val}, {max_val}]")
+                _log(f"  ✓ Eixo X: {numbers} → [{min_val}, {max_val}]")
                 return AxisCalibration(min_val, max_val, zero_pos, '', is_symmetric)
             
         except Exception as e:
-            print(f"  ⚠️ Erro OCR X: {e}")
+            _log(f"  ⚠️ Erro OCR X: {e}")
         
-        print("  ⚠️ OCR X falhou, usando [0, 1]")
+        _log("  ⚠️ OCR X falhou, usando [0, 1]")
         return AxisCalibration(0.0, 1.0)
     
     def calibrate_y_axis(self) -> AxisCalibration:
@@ -82,7 +289,7 @@ class AxisCalibratorV3:
             margin_h = 200  # Largura da faixa
             margin_v = 20   # Margem vertical
             
-            roi = self.img[
+            roi = self.gray[
                 max(0, y1 - margin_v):min(y2 + margin_v, self.h),
                 max(0, x1 - margin_h):x1
             ]
@@ -99,13 +306,13 @@ class AxisCalibratorV3:
                 min_val = min(numbers)
                 max_val = max(numbers)
                 
-                print(f"  ✓ Eixo Y: {numbers} → [{min_val}, {max_val}]")
+                _log(f"  ✓ Eixo Y: {numbers} → [{min_val}, {max_val}]")
                 return AxisCalibration(min_val, max_val)
             
         except Exception as e:
-            print(f"  ⚠️ Erro OCR Y: {e}")
+            _log(f"  ⚠️ Erro OCR Y: {e}")
         
-        print("  ⚠️ OCR Y falhou, usando [0, 1]")
+        _log("  ⚠️ OCR Y falhou, usando [0, 1]")
         return AxisCalibration(0.0, 1.0)
     
     def _extract_numbers_robust(self, roi: np.ndarray) -> List[float]:
@@ -116,132 +323,242 @@ class AxisCalibratorV3:
         if roi.size == 0 or roi.shape[0] < 10 or roi.shape[1] < 10:
             return []
         
+        # Mesma ROI (pixel a pixel) já processada: devolve sem refazer o pipeline
+        key = (roi.shape, hashlib.blake2b(roi.tobytes(), digest_size=8).digest())
+        with _roi_cache_lock:
+            cached = _roi_cache.get(key)
+            if cached is not None:
+                _roi_cache.move_to_end(key)
+                return list(cached)
+        
         gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY) if len(roi.shape) == 3 else roi
+        
+        # Caminho rápido: faixa em branco não tem o que ler (não entra no cache)
+        if not self._has_glyphs(gray):
+            return []
+        
+        # Falha do Tesseract (exceção) não pode virar "ROI sem números" no cache
+        _scratch.ocr_failures = 0
+        numbers = self._extract_numbers_uncached(gray)
+        if _scratch.ocr_failures:
+            return list(numbers)
+        
+        with _roi_cache_lock:
+            _roi_cache[key] = numbers
+            if len(_roi_cache) > _ROI_CACHE_SIZE:
+                _roi_cache.popitem(last=False)
+        
+        return list(numbers)
+    
+    def _extract_numbers_uncached(self, roi: np.ndarray) -> List[float]:
+        """Pipeline de OCR de uma ROI (sem o cache por ROI)"""
+        gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY) if len(roi.shape) == 3 else roi
+        
+        # Resize para melhorar OCR (uma vez, compartilhado por todas as estratégias)
+        h, w = gray.shape[:2]
+        if w < _OCR_MIN_WIDTH:
+            scale = _OCR_TARGET_WIDTH / w
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+        
         all_numbers = []
         
         # Estratégia 1: Tesseract direto em escala de cinza
         nums1 = self._ocr_tesseract(gray)
         all_numbers.extend(nums1)
         
+        # Atalho: se a estratégia 1 já leu os rótulos, evita as demais
+        if not self._confidence_ok(nums1):
+            all_numbers.extend(self._ocr_fallback_strategies(gray))
+        
+        # Remover duplicatas e ordenar; arredondar antes funde quase-duplicatas
+        # de leituras ruidosas (100.0 vs 100.001)
+        unique = sorted({round(n, _DEDUPE_DECIMALS) for n in all_numbers})
+        
+        # Remover outliers se houver muitos valores
+        if len(unique) > 4:
+            unique = self._remove_outliers_iqr(unique)
+        
+        return unique
+    
+    def _has_glyphs(self, gray: np.ndarray) -> bool:
+        """
+        Verifica via componentes conexos se a ROI tem algum traço (só descarta
+        faixas em branco). Roda na ROI original, antes do resize: sem limites
+        de largura/área, já que fontes finas e rótulos colados ao eixo ou aos
+        ticks formam componentes de qualquer tamanho
+        """
+        # Texto escuro em fundo claro é o caso comum; inverter se o fundo for escuro
+        mode = cv2.THRESH_BINARY_INV if np.mean(gray) > 127 else cv2.THRESH_BINARY
+        _, binary = cv2.threshold(gray, 0, 255, mode + cv2.THRESH_OTSU)
+        
+        n, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+        if n <= 1:
+            return False
+        
+        # Altura >= 2 ignora só ruído de 1 pixel de altura
+        return bool(np.any(stats[1:, cv2.CC_STAT_HEIGHT] >= 2))
+    
+    def _ocr_fallback_strategies(self, gray: np.ndarray) -> List[float]:
+        """
+        Estratégias 2-5, usadas quando a leitura direta não basta
+        As variantes são empilhadas em um único mosaico para pagar o custo
+        fixo de inicialização do Tesseract apenas uma vez
+        """
+        # Todas as variantes têm o formato da ROI: cada uma é escrita direto na
+        # sua faixa do mosaico (sem arrays intermediários nem vstack)
+        h, w = gray.shape
+        n_variants = 4
+        mosaic = _mosaic_buffer(n_variants * h + (n_variants - 1) * _MOSAIC_GAP, w)
+        binary, binary_inv, adaptive, enhanced = (
+            mosaic[i * (h + _MOSAIC_GAP):i * (h + _MOSAIC_GAP) + h] for i in range(n_variants)
+        )
+        
+        # Só as faixas separadoras precisam ser repintadas; as variantes sobrescrevem o resto
+        for i in range(1, n_variants):
+            mosaic[i * (h + _MOSAIC_GAP) - _MOSAIC_GAP:i * (h + _MOSAIC_GAP)] = 255
+        
         # Estratégia 2: Threshold binário (branco em preto)
-        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        nums2 = self._ocr_tesseract(binary)
-        all_numbers.extend(nums2)
+        cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=binary)
         
         # Estratégia 3: Threshold binário invertido (preto em branco)
-        _, binary_inv = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-        nums3 = self._ocr_tesseract(binary_inv)
-        all_numbers.extend(nums3)
-        
-        # Estratégia 4: Adaptativo Gaussiano
-        adaptive = cv2.adaptiveThreshold(
-            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-            cv2.THRESH_BINARY, 11, 2
+        # Mesmo limiar de Otsu: o complemento dispensa um segundo histograma
+        cv2.bitwise_not(binary, dst=binary_inv)
+        
+        # Estratégia 4: Adaptativo por média (box filter, mais barato que o Gaussiano)
+        cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, 
+            cv2.THRESH_BINARY, 11, 2, dst=adaptive
         )
-        nums4 = self._ocr_tesseract(adaptive)
-        all_numbers.extend(nums4)
         
         # Estratégia 5: Contraste aumentado
-        enhanced = self._enhance_contrast(roi)
-        nums5 = self._ocr_tesseract(enhanced)
-        all_numbers.extend(nums5)
+        enhanced[:] = self._enhance_contrast(gray)
         
-        # Remover duplicatas e ordenar
-        unique = sorted(set(all_numbers))
+        # Variantes quase uniformes (limiar fora da faixa dos rótulos) ou idênticas
+        # (comum em imagens já bimodais) só gastariam OCR: compactar as faixas
+        # úteis no início do mosaico
+        seen = set()
+        n_unique = 0
+        for i, band in enumerate((binary, binary_inv, adaptive, enhanced)):
+            ink = cv2.countNonZero(band) / band.size
+            if ink < _BLANK_FRACTION or ink > 1.0 - _BLANK_FRACTION:
+                continue
+            
+            key = hashlib.blake2b(band, digest_size=8).digest()
+            if key in seen:
+                continue
+            seen.add(key)
+            if i != n_unique:
+                start = n_unique * (h + _MOSAIC_GAP)
+                mosaic[start:start + h] = band
+            n_unique += 1
         
-        # Remover outliers se houver muitos valores
-        if len(unique) > 4:
-            unique = self._remove_outliers_iqr(unique)
+        if n_unique == 0:
+            return []
         
-        return unique
+        return self._ocr_tesseract(mosaic[:n_unique * (h + _MOSAIC_GAP) - _MOSAIC_GAP])
+    
+    def _confidence_ok(self, numbers: List[float]) -> bool:
+        """
+        Verifica se os números lidos já bastam para calibrar o eixo:
+        rótulos igualmente espaçados, ou ao menos 2 valores distintos
+        cobrindo mais de 10% da escala
+        """
+        distinct = sorted(set(numbers))
+        if self._looks_linear(distinct):
+            return True
+        
+        if len(distinct) < 2:
+            return False
+        
+        lo, hi = distinct[0], distinct[-1]
+        return (hi - lo) > 0.1 * max(abs(lo), abs(hi))
+    
+    def _looks_linear(self, values: List[float], tol: float = 0.1) -> bool:
+        """Ticks de eixo linear: ao menos 4 valores ordenados com passo quase constante"""
+        if len(values) < 4:
+            return False
+        
+        steps = [b - a for a, b in zip(values, values[1:])]
+        mean = sum(steps) / len(steps)
+        if mean <= 0:
+            return False
+        
+        std = math.sqrt(sum((st - mean) ** 2 for st in steps) / len(steps))
+        return std / mean < tol
     
-    def _ocr_tesseract(self, img) -> List[float]:
-        """Executa Tesseract OCR em uma imagem"""
+    def _ocr_tesseract(self, img, psm: int = 6) -> List[float]:
+        """Executa Tesseract OCR em uma imagem (com cache por conteúdo)"""
+        key = (hashlib.blake2b(img.tobytes(), digest_size=8).digest(), img.shape, psm)
+        with _ocr_cache_lock:
+            cached = _ocr_cache.get(key)
+            if cached is not None:
+                _ocr_cache.move_to_end(key)
+                return list(cached)
+        
         try:
-            # Converter para PIL
-            if len(img.shape) == 2:
-                pil_img = Image.fromarray(img)
-            else:
-                pil_img = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-            
-            # Resize para melhorar OCR
-            w, h = pil_img.size
-            if w < 600:
-                scale = 600 / w
-                pil_img = pil_img.resize(
-                    (int(w * scale), int(h * scale)),
-                    Image.Resampling.LANCZOS
-                )
-            
             # OCR com whitelist de caracteres numéricos
-            text = pytesseract.image_to_string(
-                pil_img,
-                config='--psm 6 --oem 3 -c tessedit_char_whitelist=0123456789.,-'
-            )
+            text = _image_to_string(img, psm)
             
-            return self._parse_numbers(text)
+            numbers = self._parse_numbers(text)
             
         except Exception:
+            _scratch.ocr_failures = getattr(_scratch, 'ocr_failures', 0) + 1
             return []
+        
+        with _ocr_cache_lock:
+            _ocr_cache[key] = numbers
+            if len(_ocr_cache) > _OCR_CACHE_SIZE:
+                _ocr_cache.popitem(last=False)
+        
+        return list(numbers)
     
     def _parse_numbers(self, text: str) -> List[float]:
         """Extrai números do texto OCR"""
-        # Padrões de números (do mais específico ao mais geral)
-        patterns = [
-            r'\b(19\d{2}|20\d{2})\b',  # Anos (ex: 2024)
-            r'-?\d+[.,]\d+',             # Decimais
-            r'-?\d+',                    # Inteiros
-        ]
-        
-        numbers = []
-        text_clean = text.replace(' ', '').replace('\n', ' ')
-        
-        for pattern in patterns:
-            matches = re.findall(pattern, text_clean)
-            for match in matches:
-                try:
-                    # Normalizar vírgula/ponto
-                    num_str = match.replace(',', '.')
-                    num = float(num_str)
-                    
-                    # Filtro básico: valores razoáveis
-                    if -10000 < num < 100000:
-                        numbers.append(num)
-                        
-                except (ValueError, IndexError):
-                    continue
-        
-        return numbers
-    
-    def _enhance_contrast(self, img: np.ndarray) -> np.ndarray:
-        """Aumenta contraste da imagem"""
-        if len(img.shape) == 2:
-            # Já é escala de cinza
-            pil_img = Image.fromarray(img)
-        else:
-            pil_img = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+        text_clean = _THOUSANDS_LINE_RE.sub(
+            lambda m: m.group(1) + _WS_RE.sub('', m.group(2)), text
+        )
+        text_clean = _INNER_SPACE_RE.sub('', text_clean)
         
-        enhancer = ImageEnhance.Contrast(pil_img)
-        enhanced = enhancer.enhance(2.5)
+        # Uma única varredura; todo trecho casado por _NUM_RE é um float válido
+        # após normalizar vírgula/ponto, então não há conversão que possa falhar
+        values = (float(m.group().replace(',', '.')) for m in _NUM_RE.finditer(text_clean))
         
-        if len(img.shape) == 2:
-            return np.array(enhanced)
-        else:
-            return cv2.cvtColor(np.array(enhanced), cv2.COLOR_RGB2BGR)
+        # Filtro básico: valores razoáveis
+        return [v for v in values if -10000 < v < 100000]
+    
+    def _enhance_contrast(self, gray: np.ndarray) -> np.ndarray:
+        """Aumenta contraste da imagem em escala de cinza (CLAHE)"""
+        clahe = getattr(_scratch, 'clahe', None)
+        if clahe is None:
+            # Objeto CLAHE guarda estado interno: um por thread
+            clahe = _scratch.clahe = cv2.createCLAHE(
+                clipLimit=_CLAHE_CLIP_LIMIT, tileGridSize=_CLAHE_TILE_GRID
+            )
+        return clahe.apply(gray)
     
     def _remove_outliers_iqr(self, numbers: List[float]) -> List[float]:
         """Remove outliers usando método IQR"""
         if len(numbers) < 4:
             return numbers
         
-        q1 = np.percentile(numbers, 25)
-        q3 = np.percentile(numbers, 75)
+        # Listas de rótulos são pequenas: ordenar uma vez e interpolar é mais
+        # barato que o overhead de despacho do NumPy
+        if len(numbers) > _IQR_NUMPY_MIN:
+            arr = np.asarray(numbers, dtype=np.float64)
+            q1, q3 = _quantiles_partition(arr, (0.25, 0.75))
+        else:
+            ordered = sorted(numbers)
+            q1 = _quantile_sorted(ordered, 0.25)
+            q3 = _quantile_sorted(ordered, 0.75)
         iqr = q3 - q1
         
         # Limites mais generosos (3x IQR)
         lower = q1 - 3 * iqr
         upper = q3 + 3 * iqr
         
-        filtered = [n for n in numbers if lower <= n <= upper]
+        if len(numbers) > _IQR_NUMPY_MIN:
+            filtered = arr[(arr >= lower) & (arr <= upper)].tolist()
+        else:
+            filtered = [n for n in numbers if lower <= n <= upper]
         
         return filtered if filtered else numbers
@@ -1,20 +1,32 @@
 """
 Tipos de dados para o Graph Extractor
 """
+import math
+import numpy as np
 from dataclasses import dataclass
 from typing import Tuple, Optional
 
 
-@dataclass
+# Códigos de marker_type usados na representação estruturada (SoA) dos pontos
+MARKER_TYPES = ('point', 'square', 'circle', 'x', 'triangle', 'hollow', 'curve', 'marker')
+
+POINT_DTYPE = np.dtype([
+    ('x', 'f4'), ('y', 'f4'),
+    ('r', 'u1'), ('g', 'u1'), ('b', 'u1'),
+    ('marker', 'u1')
+])
+
+
+@dataclass(slots=True)
 class Point:
     """Representa um ponto detectado no gráfico"""
     x: float
     y: float
     color: Tuple[int, int, int]
-    marker_type: str = 'point'  # 'point', 'square', 'circle', 'x', 'triangle', 'hollow', 'curve'
+    marker_type: str = 'point'  # 'point', 'square', 'circle', 'x', 'triangle', 'hollow', 'curve', 'marker'
 
 
-@dataclass
+@dataclass(slots=True)
 class GraphAxis:
     """Representa um eixo do gráfico"""
     x1: int
@@ -25,10 +37,10 @@ class GraphAxis:
     
     def length(self) -> float:
         """Calcula o comprimento do eixo"""
-        return ((self.x2 - self.x1)**2 + (self.y2 - self.y1)**2)**0.5
+        return math.hypot(self.x2 - self.x1, self.y2 - self.y1)
 
 
-@dataclass
+@dataclass(slots=True)
 class GraphFrame:
     """Representa a moldura/frame do gráfico"""
     top_left: Tuple[int, int]
@@ -39,7 +51,7 @@ class GraphFrame:
     height: int
 
 
-@dataclass
+@dataclass(slots=True)
 class AxisCalibration:
     """Armazena calibração dos eixos com valores mín, máx e zero"""
     min_value: float
@@ -1,17 +1,103 @@
 """
 Módulo de exportação de dados
 """
+import csv
 import cv2
 import numpy as np
 import pandas as pd
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, List
+from functools import cached_property
+from itertools import repeat
+from types import MappingProxyType
+from typing import Dict, List, IO, Optional, Union
 try:
     from .data_types import GraphFrame, AxisCalibration
 except ImportError:
     from data_types import GraphFrame, AxisCalibration
 
 
+# Linha do TXT: x e y com 6 casas, separados por tab
+_TXT_ROW = "{:.6f}\t{:.6f}\t{}\n"
+
+
+# Cor do gráfico do Excel por nome de cor (prefixo da série, ex: 'Red_points')
+_COLOR_HEX = MappingProxyType({
+    'Red': '#FF0000', 'Blue': '#0000FF', 'Green': '#00FF00', 'Black': '#000000',
+    'Yellow': '#FFFF00', 'Purple': '#800080', 'Orange': '#FFA500'
+})
+
+
+def _series_hex(series_key: str) -> str:
+    """Cor hex da série a partir do nome da cor antes do '_'"""
+    return _COLOR_HEX.get(str(series_key).split('_', 1)[0], '#000000')
+
+
+# Cor e meio-lado (px) dos marcadores da visualização
+_MARKER_COLOR = (0, 255, 255)
+_MARKER_HALF = 3
+
+
+def _draw_marker(vis: np.ndarray, kind: str, cx: int, cy: int):
+    """Desenha um marcador com as primitivas do OpenCV (recorta nas bordas)"""
+    h = _MARKER_HALF
+    if kind == 'square':
+        cv2.rectangle(vis, (cx-h, cy-h), (cx+h, cy+h), _MARKER_COLOR, 1)
+    elif kind == 'x':
+        cv2.line(vis, (cx-h, cy-h), (cx+h, cy+h), _MARKER_COLOR, 1)
+        cv2.line(vis, (cx-h, cy+h), (cx+h, cy-h), _MARKER_COLOR, 1)
+    else:
+        cv2.circle(vis, (cx, cy), h, _MARKER_COLOR, 1)
+
+
+def _sprite_offsets(kind: str) -> tuple:
+    """Deslocamentos (dy, dx) dos pixels acesos do marcador, renderizado uma vez"""
+    size = 2 * _MARKER_HALF + 1
+    sprite = np.zeros((size, size, 3), dtype=np.uint8)
+    _draw_marker(sprite, kind, _MARKER_HALF, _MARKER_HALF)
+    dy, dx = np.nonzero(sprite.any(axis=2))
+    return dy - _MARKER_HALF, dx - _MARKER_HALF
+
+
+_MARKER_SPRITES = {kind: _sprite_offsets(kind) for kind in ('square', 'x', 'circle')}
+
+
+def _draw_markers(vis: np.ndarray, kind: str, px: np.ndarray, py: np.ndarray):
+    """
+    Desenha todos os marcadores de um tipo de uma vez: os que cabem inteiros
+    na imagem são 'carimbados' com uma única atribuição indexada; os da borda
+    (ou fora dela) passam pelo OpenCV, que faz o recorte
+    """
+    h = _MARKER_HALF
+    inside = (px >= h) & (px < vis.shape[1] - h) & (py >= h) & (py < vis.shape[0] - h)
+    if vis.ndim != 3 or vis.shape[2] != 3:
+        inside[:] = False
+    
+    if inside.any():
+        dy, dx = _MARKER_SPRITES[kind]
+        vis[py[inside, None] + dy, px[inside, None] + dx] = _MARKER_COLOR
+    
+    for cx, cy in zip(px[~inside].tolist(), py[~inside].tolist()):
+        _draw_marker(vis, kind, cx, cy)
+
+
+def _sorted_by_x(points: pd.DataFrame) -> pd.DataFrame:
+    """Séries já chegam ordenadas por x; só reordena se o invariante foi quebrado"""
+    if points['x'].is_monotonic_increasing:
+        return points
+    return points.sort_values('x', kind='stable', ignore_index=True)
+
+
+@contextmanager
+def _text_writer(target: Union[str, IO[str]]):
+    """Abre o caminho para escrita em UTF-8, ou usa o objeto arquivo recebido como está"""
+    if hasattr(target, 'write'):
+        yield target
+    else:
+        with open(target, 'w', encoding='utf-8') as f:
+            yield f
+
+
 class DataExporter:
     """Exporta dados para múltiplos formatos"""
     
@@ -24,44 +110,93 @@ class DataExporter:
         self.y_calib = y_calib
         self.data_points = data_points
     
-    def to_excel(self, output_path: str):
-        """Exporta para Excel com gráficos"""
-        with pd.ExcelWriter(output_path, engine='xlsxwriter') as writer:
-            workbook = writer.book
+    @cached_property
+    def _sorted_series(self) -> Dict[str, pd.DataFrame]:
+        """Séries ordenadas por x, calculadas uma vez e compartilhadas pelos formatos"""
+        return {color: _sorted_by_x(points) for color, points in self.data_points.items()}
+    
+    @cached_property
+    def _total_points(self) -> int:
+        """Total de pontos de todas as séries (dados imutáveis após process())"""
+        return sum(map(len, self.data_points.values()))
+    
+    def prepare(self):
+        """
+        Pré-calcula as séries ordenadas e o total de pontos compartilhados pelos
+        formatos; chamar antes de exportar em paralelo (cada thread só lê)
+        """
+        self._sorted_series
+        self._total_points
+    
+    def to_excel(self, output_path: Union[str, IO[bytes]], with_charts: bool = True):
+        """
+        Exporta para Excel (caminho ou buffer binário, ex: BytesIO)
+        Por padrão usa xlsxwriter e embute um gráfico de dispersão por série;
+        with_charts=False grava só os dados em modo write-only do openpyxl
+        (linhas em streaming, sem árvore de células em memória)
+        """
+        if with_charts:
+            self._to_excel_with_charts(output_path)
+            return
+        
+        from openpyxl import Workbook
+        
+        wb = Workbook(write_only=True)
+        
+        ws = wb.create_sheet('Metadata')
+        ws.append(('Property', 'Value'))
+        for row in self._metadata_rows():
+            ws.append(row)
+        
+        for color, df in self._sorted_series.items():
+            if not color or df.empty:
+                continue
             
+            ws = wb.create_sheet(str(color)[:31])
+            
+            # Mesmo layout da versão com gráficos: cabeçalho na linha 2
+            ws.append(())
+            ws.append(tuple(df.columns))
+            for row in zip(*(df[col].tolist() for col in df.columns)):
+                ws.append(row)
+        
+        wb.save(output_path)
+    
+    def _metadata_rows(self) -> List[tuple]:
+        """Linhas (propriedade, valor) da aba Metadata"""
+        return [
+            ('Image', self.image_path),
+            ('Timestamp', datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+            ('Frame Size', f"{self.frame.width}x{self.frame.height}"),
+            ('X Range', f"[{self.x_calib.min_value:.2f}, {self.x_calib.max_value:.2f}]"),
+            ('Y Range', f"[{self.y_calib.min_value:.2f}, {self.y_calib.max_value:.2f}]"),
+            ('X Zero Position', f"{self.x_calib.zero_position:.2%}" if self.x_calib.zero_position else 'N/A'),
+            ('Total Points', self._total_points),
+        ]
+    
+    def _to_excel_with_charts(self, output_path: Union[str, IO[bytes]]):
+        """Exporta para Excel com gráficos (xlsxwriter, colunas escritas direto das séries)"""
+        import xlsxwriter
+        
+        with xlsxwriter.Workbook(output_path) as workbook:
             # Metadata
-            metadata = pd.DataFrame({
-                'Property': [
-                    'Image', 'Timestamp', 'Frame Size',
-                    'X Range', 'Y Range', 'X Zero Position', 'Total Points'
-                ],
-                'Value': [
-                    self.image_path,
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    f"{self.frame.width}x{self.frame.height}",
-                    f"[{self.x_calib.min_value:.2f}, {self.x_calib.max_value:.2f}]",
-                    f"[{self.y_calib.min_value:.2f}, {self.y_calib.max_value:.2f}]",
-                    f"{self.x_calib.zero_position:.2%}" if self.x_calib.zero_position else 'N/A',
-                    sum(len(pts) for pts in self.data_points.values())
-                ]
-            })
-            metadata.to_excel(writer, sheet_name='Metadata', index=False)
+            worksheet = workbook.add_worksheet('Metadata')
+            worksheet.write_row(0, 0, ('Property', 'Value'))
+            for row, values in enumerate(self._metadata_rows(), start=1):
+                worksheet.write_row(row, 0, values)
             
             # Dados por cor com gráficos
-            color_map = {'Red': '#FF0000', 'Blue': '#0000FF', 'Green': '#00FF00', 
-                        'Black': '#000000', 'Yellow': '#FFFF00', 'Purple': '#800080'}
-            
-            for idx, (color, points) in enumerate(self.data_points.items()):
-                if not color or not points:
+            for idx, (color, df) in enumerate(self._sorted_series.items()):
+                if not color or df.empty:
                     continue
-                    
-                df = pd.DataFrame(points)
-                df = df.sort_values('x')
                 
                 sheet_name = str(color)[:31]  # Garantir que é string
-                df.to_excel(writer, sheet_name=sheet_name, index=False, startrow=1)
+                worksheet = workbook.add_worksheet(sheet_name)
                 
-                worksheet = writer.sheets[sheet_name]
+                # Cabeçalho na linha 2, dados a partir da linha 3
+                worksheet.write_row(1, 0, tuple(df.columns))
+                for col, name in enumerate(df.columns):
+                    worksheet.write_column(2, col, df[name].tolist())
                 
                 # Criar gráfico
                 chart = workbook.add_chart({'type': 'scatter', 'subtype': 'smooth'})
@@ -71,20 +206,20 @@ class DataExporter:
                     'name': color,
                     'categories': [sheet_name, 2, 0, max_row, 0],  # coluna x
                     'values': [sheet_name, 2, 1, max_row, 1],      # coluna y
-                    'line': {'color': color_map.get(color, '#000000'), 'width': 2},
+                    'line': {'color': _series_hex(color), 'width': 2},
                     'marker': {'type': 'circle', 'size': 5}
                 })
                 
                 chart.set_x_axis({'name': 'X'})
                 chart.set_y_axis({'name': 'Y'})
-                chart.set_title({'name': f'{color} - {len(points)} pontos'})
+                chart.set_title({'name': f'{color} - {len(df)} pontos'})
                 chart.set_size({'width': 720, 'height': 480})
                 
                 worksheet.insert_chart('E2', chart)
     
-    def to_txt(self, output_path: str):
-        """Exporta para TXT"""
-        with open(output_path, 'w', encoding='utf-8') as f:
+    def to_txt(self, output_path: Union[str, IO[str]]):
+        """Exporta para TXT (caminho ou buffer de texto, ex: StringIO)"""
+        with _text_writer(output_path) as f:
             f.write("# Graph Data Extraction Results\n")
             f.write(f"# Image: {self.image_path}\n")
             f.write(f"# Timestamp: {datetime.now()}\n\n")
@@ -92,54 +227,61 @@ class DataExporter:
             f.write(f"# X Axis: [{self.x_calib.min_value:.2f}, {self.x_calib.max_value:.2f}]\n")
             f.write(f"# Y Axis: [{self.y_calib.min_value:.2f}, {self.y_calib.max_value:.2f}]\n\n")
             
-            for color, points in self.data_points.items():
-                f.write(f"\n## {color} ({len(points)} points)\n")
+            for color, df in self._sorted_series.items():
+                f.write(f"\n## {color} ({len(df)} points)\n")
                 f.write("x\ty\ttype\n")
                 
-                for pt in sorted(points, key=lambda p: p['x']):
-                    f.write(f"{pt['x']:.6f}\t{pt['y']:.6f}\t{pt['type']}\n")
+                f.writelines(map(_TXT_ROW.format, df['x'].tolist(), df['y'].tolist(), df['type'].tolist()))
     
-    def to_csv(self, output_path: str):
-        """Exporta para CSV (todos os dados em um arquivo)"""
-        all_data = []
-        
-        for color, points in self.data_points.items():
-            for pt in points:
-                all_data.append({
-                    'series': color,
-                    'x': pt['x'],
-                    'y': pt['y'],
-                    'marker_type': pt['type']
-                })
-        
-        df = pd.DataFrame(all_data)
-        df = df.sort_values(['series', 'x'])
-        df.to_csv(output_path, index=False)
+    def to_csv(self, output_path: Union[str, IO[str]]):
+        """Exporta para CSV (todos os dados em um arquivo; caminho ou buffer de texto)"""
+        with _text_writer(output_path) as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(('series', 'x', 'y', 'marker_type'))
+            
+            # Séries já ordenadas por x: escrever em ordem de nome dispensa o sort global
+            for color in sorted(self._sorted_series):
+                df = self._sorted_series[color]
+                writer.writerows(zip(repeat(color), df['x'].tolist(), df['y'].tolist(), df['type'].tolist()))
     
-    def visualize(self, img: np.ndarray) -> np.ndarray:
-        """Cria visualização dos pontos detectados"""
-        vis = img.copy()
+    def visualize(self, img: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Cria visualização dos pontos detectados
+        out: buffer reutilizável (mesmo shape/dtype de img) onde desenhar, evitando
+        alocar uma cópia da imagem a cada chamada; senão desenha sobre img.copy()
+        """
+        if out is not None and out.shape == img.shape and out.dtype == img.dtype:
+            np.copyto(out, img)
+            vis = out
+        else:
+            vis = img.copy()
         
         # Desenhar frame
         cv2.rectangle(vis, self.frame.top_left, self.frame.bottom_right, (0, 255, 0), 2)
         
         # Desenhar pontos
+        x_min, y_min = self.x_calib.min_value, self.y_calib.min_value
+        x_span = self.x_calib.max_value - x_min
+        y_span = self.y_calib.max_value - y_min
+        
         for color_name, points in self.data_points.items():
-            for pt in points:
-                # Converter de volta para pixel
-                norm_x = (pt['x'] - self.x_calib.min_value) / (self.x_calib.max_value - self.x_calib.min_value)
-                norm_y = (pt['y'] - self.y_calib.min_value) / (self.y_calib.max_value - self.y_calib.min_value)
-                
-                px = int(self.frame.bottom_left[0] + norm_x * self.frame.width)
-                py = int(self.frame.top_left[1] + (1.0 - norm_y) * self.frame.height)
-                
-                # Desenhar marcador apropriado
-                if pt['type'] == 'square':
-                    cv2.rectangle(vis, (px-3, py-3), (px+3, py+3), (0, 255, 255), 1)
-                elif pt['type'] == 'x':
-                    cv2.line(vis, (px-3, py-3), (px+3, py+3), (0, 255, 255), 1)
-                    cv2.line(vis, (px-3, py+3), (px+3, py-3), (0, 255, 255), 1)
-                else:
-                    cv2.circle(vis, (px, py), 3, (0, 255, 255), 1)
+            if points.empty:
+                continue
+            
+            # Converter de volta para pixel (série inteira de uma vez; astype trunca como int())
+            norm_x = (points['x'].to_numpy(np.float64) - x_min) / x_span
+            norm_y = (points['y'].to_numpy(np.float64) - y_min) / y_span
+            px = (self.frame.bottom_left[0] + norm_x * self.frame.width).astype(np.int32)
+            py = (self.frame.top_left[1] + (1.0 - norm_y) * self.frame.height).astype(np.int32)
+            types = points['type'].to_numpy()
+            
+            # Desenhar marcador apropriado, agrupado por tipo
+            is_square = types == 'square'
+            is_x = types == 'x'
+            other = ~(is_square | is_x)
+            
+            for kind, sel in (('square', is_square), ('x', is_x), ('circle', other)):
+                if sel.any():
+                    _draw_markers(vis, kind, px[sel], py[sel])
         
         return vis
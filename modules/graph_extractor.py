@@ -6,8 +6,12 @@ Usa:
 - calibrator_v3 (OCR robusto)
 """
 import cv2
+import io
 import numpy as np
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Optional
+from PIL import Image, UnidentifiedImageError
 try:
     from .axis_detector import AxisDetector
     from .calibrator import AxisCalibratorV3
@@ -24,12 +28,88 @@ except ImportError:
     from preprocessor import preprocess_image
 
 
+# Flags de decodificação reduzida do OpenCV por fator de escala
+_REDUCED_COLOR_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+def _load_image(image_path: str, max_dim: Optional[int] = None):
+    """
+    Carrega a imagem em BGR; com max_dim, escolhe o menor fator de redução
+    (2, 4 ou 8) que deixa o maior lado <= max_dim. Em JPEG a redução acontece
+    dentro do próprio decodificador (mais rápido e com menos memória)
+    Lê os bytes com np.fromfile + cv2.imdecode: funciona com caminhos não-ASCII
+    e o arquivo é lido do disco uma única vez; o tamanho vem do cabeçalho (PIL),
+    sem decodificar os pixels
+    Retorna: (imagem ou None, fator de escala)
+    """
+    try:
+        buf = np.fromfile(image_path, dtype=np.uint8)
+    except OSError:
+        return None, 1
+    
+    if buf.size == 0:
+        return None, 1
+    
+    if max_dim is None:
+        return cv2.imdecode(buf, cv2.IMREAD_COLOR), 1
+    
+    # Tamanho exato lido só do cabeçalho; formato que o PIL não reconhece
+    # cai para uma decodificação completa (que já serve se couber em max_dim)
+    try:
+        with Image.open(io.BytesIO(buf)) as header:
+            longest = max(header.size)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        img = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+        if img is None or max(img.shape[:2]) <= max_dim:
+            return img, 1
+        longest = max(img.shape[:2])
+    else:
+        if longest <= max_dim:
+            return cv2.imdecode(buf, cv2.IMREAD_COLOR), 1
+    
+    for factor, flag in _REDUCED_COLOR_FLAGS.items():
+        if longest / factor <= max_dim:
+            break
+    
+    return cv2.imdecode(buf, flag), factor
+
+
+def _invertible(calib: Optional[AxisCalibration]) -> bool:
+    """Calibração da qual dá para recuperar a coordenada normalizada (0-1)"""
+    if calib is None or calib.max_value == calib.min_value:
+        return False
+    if calib.zero_position is not None:
+        # Só é bijetivo com o zero dentro do eixo (min < 0 < max)
+        return 0.0 < calib.zero_position < 1.0 and calib.min_value < 0 < calib.max_value
+    return True
+
+
+def _real_to_normalized_x(real_x: np.ndarray, calib: AxisCalibration) -> np.ndarray:
+    """Inverso de MarkerDetectorV3._pixel_to_real_x, vetorizado"""
+    if calib.zero_position is None:
+        return (real_x - calib.min_value) / (calib.max_value - calib.min_value)
+    
+    zero = calib.zero_position
+    # Valores negativos vêm do trecho à esquerda do zero
+    return np.where(
+        real_x < 0,
+        real_x / calib.min_value * zero,
+        zero + real_x / calib.max_value * (1.0 - zero)
+    )
+
+
 class GraphExtractor:
     """Classe principal para extração de dados de gráficos - V3"""
     
-    def __init__(self, image_path: str, grid_divisions: int = 100, remove_legends: bool = True):
+    def __init__(self, image_path: str, grid_divisions: int = 100, remove_legends: bool = True,
+                 max_dim: Optional[int] = None):
+        """
+        max_dim: se definido, imagens maiores são decodificadas já reduzidas
+        (1/2, 1/4 ou 1/8) para que o maior lado fique <= max_dim; as coordenadas
+        de pixel (frame, visualização) passam a ser as da imagem reduzida
+        """
         self.image_path = image_path
-        self.img_original = cv2.imread(image_path)
+        self.img_original, self.scale = _load_image(image_path, max_dim)
         
         if self.img_original is None:
             raise ValueError(f"Erro ao carregar imagem: {image_path}")
@@ -49,9 +129,16 @@ class GraphExtractor:
         self.frame: Optional[GraphFrame] = None
         self.x_calibration: Optional[AxisCalibration] = None
         self.y_calibration: Optional[AxisCalibration] = None
-        self.data_points: Dict = {}
+        self.data_points: Dict = {}  # {série: DataFrame(x, y, type) ordenado por x}
+        self._series_counts: Dict[str, int] = {}
+        self._total_points = 0
+        self._exporter: Optional[DataExporter] = None
+        self._exporter_lock = threading.Lock()
+        self._marker_detector: Optional[MarkerDetectorV3] = None
         
         print(f"📸 Imagem carregada: {self.img.shape[1]}x{self.img.shape[0]} pixels")
+        if self.scale > 1:
+            print(f"  ✓ Decodificada em 1/{self.scale} (max_dim={max_dim})")
     
     def process(self) -> Dict:
         """Executa pipeline completo de extração"""
@@ -60,9 +147,12 @@ class GraphExtractor:
         print("="*60)
         
         try:
+            # Escala de cinza calculada uma vez e compartilhada pelos detectores
+            gray = cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY)
+            
             # 1. Detectar eixos
             print("\n🔍 Passo 1: Detectando eixos...")
-            detector = AxisDetector(self.img)
+            detector = AxisDetector(self.img, gray=gray)
             axes = detector.detect_axes()
             
             # 2. Encontrar frame
@@ -73,9 +163,8 @@ class GraphExtractor:
             
             # 3. Calibrar eixos
             print("\n📏 Passo 3: Calibrando eixos...")
-            calibrator = AxisCalibratorV3(self.img, self.frame)
-            self.x_calibration = calibrator.calibrate_x_axis()
-            self.y_calibration = calibrator.calibrate_y_axis()
+            calibrator = AxisCalibratorV3(self.img, self.frame, gray=gray)
+            self.x_calibration, self.y_calibration = calibrator.calibrate_axes()
             
             print(f"  ✓ Eixo X: [{self.x_calibration.min_value:.2f}, {self.x_calibration.max_value:.2f}]")
             if self.x_calibration.zero_position:
@@ -84,8 +173,9 @@ class GraphExtractor:
             
             # 4. Detectar marcadores (VERSÃO HÍBRIDA)
             print(f"\n🎯 Passo 4: Detectando pontos (HSV + Grid {self.grid_divisions}x{self.grid_divisions})...")
-            marker_det = MarkerDetectorV3(self.img, self.frame, grid_divisions=self.grid_divisions)
-            self.data_points = marker_det.detect_all(self.x_calibration, self.y_calibration)
+            marker_det = MarkerDetectorV3(self.img, self.frame, grid_divisions=self.grid_divisions, gray=gray)
+            self._marker_detector = marker_det
+            self._set_data_points(marker_det.detect_all(self.x_calibration, self.y_calibration))
             
             print("\n" + "="*60)
             print("✅ EXTRAÇÃO CONCLUÍDA COM SUCESSO!")
@@ -97,8 +187,29 @@ class GraphExtractor:
             print(f"\n❌ ERRO: {str(e)}")
             raise
     
-    def export_excel(self, output_path: str):
-        """Exporta para Excel"""
+    def _set_data_points(self, data_points: Dict):
+        """Troca as séries e atualiza contagens e exporter derivados delas"""
+        self.data_points = data_points
+        self._series_counts = dict(zip(data_points, map(len, data_points.values())))
+        self._total_points = sum(self._series_counts.values())
+        self._exporter = None
+    
+    def _get_exporter(self) -> DataExporter:
+        """DataExporter do último process(), criado sob demanda e reutilizado entre formatos"""
+        with self._exporter_lock:
+            if self._exporter is None:
+                exporter = DataExporter(
+                    self.image_path, self.frame,
+                    self.x_calibration, self.y_calibration,
+                    self.data_points
+                )
+                # Ordenação das séries calculada aqui, sob o lock, e não em cada thread de export_all
+                exporter.prepare()
+                self._exporter = exporter
+            return self._exporter
+    
+    def export_excel(self, output_path: str, with_charts: bool = True):
+        """Exporta para Excel (with_charts=False: só os dados, em modo write-only)"""
         if not self.data_points:
             raise ValueError("Nenhum dado para exportar. Execute process() primeiro.")
         
@@ -108,12 +219,8 @@ class GraphExtractor:
         if not self.x_calibration or not self.y_calibration:
             raise ValueError("Calibração dos eixos não realizada.")
         
-        exporter = DataExporter(
-            self.image_path, self.frame,
-            self.x_calibration, self.y_calibration,
-            self.data_points
-        )
-        exporter.to_excel(output_path)
+        exporter = self._get_exporter()
+        exporter.to_excel(output_path, with_charts=with_charts)
         print(f"  ✓ Excel salvo: {output_path}")
     
     def export_txt(self, output_path: str):
@@ -121,11 +228,7 @@ class GraphExtractor:
         if not self.data_points:
             raise ValueError("Nenhum dado para exportar. Execute process() primeiro.")
         
-        exporter = DataExporter(
-            self.image_path, self.frame,
-            self.x_calibration, self.y_calibration,
-            self.data_points
-        )
+        exporter = self._get_exporter()
         exporter.to_txt(output_path)
         print(f"  ✓ TXT salvo: {output_path}")
     
@@ -134,25 +237,41 @@ class GraphExtractor:
         if not self.data_points:
             raise ValueError("Nenhum dado para exportar. Execute process() primeiro.")
         
-        exporter = DataExporter(
-            self.image_path, self.frame,
-            self.x_calibration, self.y_calibration,
-            self.data_points
-        )
+        exporter = self._get_exporter()
         exporter.to_csv(output_path)
         print(f"  ✓ CSV salvo: {output_path}")
     
-    def visualize(self, save_path: Optional[str] = None) -> np.ndarray:
-        """Cria visualização dos pontos detectados"""
+    def export_all(self, out_prefix: str) -> Dict[str, str]:
+        """
+        Exporta Excel, TXT e CSV em paralelo ({out_prefix}.xlsx/.txt/.csv)
+        Os formatos leem os mesmos dados imutáveis e escrevem em arquivos
+        distintos; compressão e escrita em disco liberam o GIL
+        Retorna: {formato: caminho}
+        """
+        paths = {
+            'excel': f"{out_prefix}.xlsx",
+            'txt': f"{out_prefix}.txt",
+            'csv': f"{out_prefix}.csv"
+        }
+        
+        with ThreadPoolExecutor(max_workers=len(paths)) as pool:
+            futures = [
+                pool.submit(self.export_excel, paths['excel']),
+                pool.submit(self.export_txt, paths['txt']),
+                pool.submit(self.export_csv, paths['csv'])
+            ]
+            for future in futures:
+                future.result()
+        
+        return paths
+    
+    def visualize(self, save_path: Optional[str] = None, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Cria visualização dos pontos detectados (out: buffer reutilizável, ver DataExporter.visualize)"""
         if not self.data_points:
             raise ValueError("Nenhum dado para visualizar. Execute process() primeiro.")
         
-        exporter = DataExporter(
-            self.image_path, self.frame,
-            self.x_calibration, self.y_calibration,
-            self.data_points
-        )
-        vis = exporter.visualize(self.img)
+        exporter = self._get_exporter()
+        vis = exporter.visualize(self.img, out=out)
         
         if save_path:
             cv2.imwrite(save_path, vis)
@@ -199,15 +318,24 @@ class GraphExtractor:
         
         summary = {
             'total_series': len(self.data_points),
-            'total_points': sum(len(pts) for pts in self.data_points.values()),
+            'total_points': self._total_points,
             'series': {}
         }
         
         for color, points in self.data_points.items():
-            marker_types = set(pt['type'] for pt in points)
+            if points.empty:
+                x_range = y_range = None
+            else:
+                xs = points['x'].to_numpy()
+                ys = points['y'].to_numpy()
+                x_range = [float(xs.min()), float(xs.max())]
+                y_range = [float(ys.min()), float(ys.max())]
+            
             summary['series'][color] = {
-                'points': len(points),
-                'marker_types': list(marker_types)
+                'points': self._series_counts[color],
+                'marker_types': points['type'].unique().tolist(),
+                'x_range': x_range,
+                'y_range': y_range
             }
         
         return summary
@@ -222,21 +350,53 @@ class GraphExtractor:
         print(f"  X: [{x_min}, {x_max}]")
         print(f"  Y: [{y_min}, {y_max}]")
         
+        old_x, old_y = self.x_calibration, self.y_calibration
         self.x_calibration = AxisCalibration(x_min, x_max)
         self.y_calibration = AxisCalibration(y_min, y_max)
+        self._exporter = None
         
         # Recalcular coordenadas dos pontos
         if self.data_points:
-            self._recalibrate_points()
+            self._recalibrate_points(old_x, old_y)
     
-    def _recalibrate_points(self):
-        """Recalcula coordenadas dos pontos com nova calibração"""
+    def _recalibrate_points(self, old_x: Optional[AxisCalibration] = None,
+                            old_y: Optional[AxisCalibration] = None):
+        """
+        Recalcula coordenadas dos pontos com nova calibração
+        Com a calibração anterior disponível, desfaz o mapeamento antigo e aplica
+        o novo sobre as colunas (sem re-detectar); senão re-processa os marcadores
+        """
         if not self.data_points or not self.frame:
             return
         
-        # Re-processar marcadores com nova calibração
-        marker_det = MarkerDetectorV3(self.img, self.frame, grid_divisions=self.grid_divisions)
-        self.data_points = marker_det.detect_all(
+        if _invertible(old_x) and _invertible(old_y):
+            x_span = self.x_calibration.max_value - self.x_calibration.min_value
+            y_span = self.y_calibration.max_value - self.y_calibration.min_value
+            old_y_min = old_y.min_value
+            old_y_span = old_y.max_value - old_y.min_value
+            
+            recalibrated = {}
+            for series_key, points in self.data_points.items():
+                norm_x = _real_to_normalized_x(points['x'].to_numpy(np.float64), old_x)
+                norm_y = (points['y'].to_numpy(np.float64) - old_y_min) / old_y_span
+                
+                df = points.assign(
+                    x=self.x_calibration.min_value + norm_x * x_span,
+                    y=self.y_calibration.min_value + norm_y * y_span
+                )
+                if not df['x'].is_monotonic_increasing:
+                    df = df.sort_values('x', kind='stable', ignore_index=True)
+                recalibrated[series_key] = df
+            
+            self._set_data_points(recalibrated)
+            return
+        
+        # Re-processar marcadores com nova calibração (mesmo frame: o detector do
+        # process() já tem a escala de cinza e o HSV do ROI)
+        marker_det = self._marker_detector
+        if marker_det is None or marker_det.frame is not self.frame:
+            marker_det = MarkerDetectorV3(self.img, self.frame, grid_divisions=self.grid_divisions)
+        self._set_data_points(marker_det.detect_all(
             self.x_calibration, 
             self.y_calibration
-        )
+        ))
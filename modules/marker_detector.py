@@ -7,22 +7,57 @@ Combina:
 """
 import cv2
 import numpy as np
-from typing import List, Tuple, Dict
-from collections import defaultdict, Counter
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Dict, Optional
 try:
-    from .data_types import Point, GraphFrame, AxisCalibration
+    from .data_types import GraphFrame, AxisCalibration, MARKER_TYPES, POINT_DTYPE
 except ImportError:
-    from data_types import Point, GraphFrame, AxisCalibration
+    from data_types import GraphFrame, AxisCalibration, MARKER_TYPES, POINT_DTYPE
+
+
+# Nome do marker_type por código (índice em MARKER_TYPES), para indexar em bloco
+_MARKER_NAMES = np.array(MARKER_TYPES, dtype=object)
+_MARKER_CODE = MARKER_TYPES.index('marker')
+
+# Nome da cor por id de classe devolvido por _classify_colors (0 = Black, o default)
+_COLOR_NAMES = ('Black', 'Orange', 'Red', 'Blue', 'Green')
+
+# Pool persistente para as duas camadas de detecção (marcadores HSV e grid de curvas)
+_pass_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='marker-pass')
+
+# Pool separado para as faixas de cor da camada HSV (que já roda dentro de _pass_pool;
+# submeter ao mesmo pool poderia travar com os dois workers ocupados)
+_color_pool = ThreadPoolExecutor(max_workers=6, thread_name_prefix='marker-color')
+
+# Ranges de cor em HSV (versão antiga), limites já como arrays uint8
+_HSV_COLOR_RANGES = {
+    name: (np.array(lower, dtype=np.uint8), np.array(upper, dtype=np.uint8))
+    for name, (lower, upper) in {
+        'blue': ([100, 50, 50], [130, 255, 255]),
+        'red1': ([0, 50, 50], [10, 255, 255]),      # Vermelho parte 1
+        'red2': ([170, 50, 50], [180, 255, 255]),   # Vermelho parte 2
+        'green': ([40, 50, 50], [80, 255, 255]),
+        'orange': ([10, 100, 100], [25, 255, 255]),  # Laranja
+        'black': ([0, 0, 0], [180, 255, 50])
+    }.items()
+}
 
 
 class MarkerDetectorV3:
     """Detector híbrido: HSV para marcadores + Grid para curvas"""
     
-    def __init__(self, img: np.ndarray, frame: GraphFrame, grid_divisions: int = 100):
+    def __init__(self, img: np.ndarray, frame: GraphFrame, grid_divisions: int = 100,
+                 gray: Optional[np.ndarray] = None):
         self.img = img
         self.frame = frame
-        self.gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        self.gray = gray if gray is not None else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         self.grid_divisions = grid_divisions
+        # HSV por limites do ROI: uma nova detecção no mesmo detector (ex: após
+        # recalibrar) reaproveita a conversão em vez de refazê-la
+        self._hsv_cache: Dict[Tuple[int, int, int, int], np.ndarray] = {}
+        # Bordas Canny por (limites do ROI, limiar baixo, limiar alto), mesmo motivo
+        self._canny_cache: Dict[Tuple[Tuple[int, int, int, int], int, int], np.ndarray] = {}
         
     def detect_all(self, x_calib: AxisCalibration, y_calib: AxisCalibration):
         """Pipeline híbrido: marcadores destacados + grid para curvas"""
@@ -32,23 +67,39 @@ class MarkerDetectorV3:
         if x2 <= x1 or y2 <= y1:
             return {}
         
-        roi = self.img[y1:y2, x1:x2].copy()
+        # Vista (sem cópia): os detectores só leem o ROI
+        roi = self.img[y1:y2, x1:x2]
         
         if roi.size == 0:
             return {}
         
+        # Espaços de cor do ROI produzidos uma única vez para as duas camadas;
+        # bordas a partir da escala de cinza compartilhada (mesmos pixels do ROI)
+        hsv = self._roi_hsv(roi, (x1, y1, x2, y2))
+        edges = self._canny((x1, y1, x2, y2), 30, 100)
+        
+        # As duas camadas são independentes: rodam em paralelo (o OpenCV libera o GIL)
+        markers_future = _pass_pool.submit(self._detect_highlighted_markers_hsv, roi, x1, y1, hsv=hsv)
+        # ROI sem nenhuma borda (frame vazio): o grid não teria célula alguma a registrar
+        if cv2.countNonZero(edges):
+            curves_future = _pass_pool.submit(
+                self._detect_curves_with_grid, roi, x1, y1, grid_size=self.grid_divisions, edges=edges
+            )
+        else:
+            curves_future = None
+        
         # ETAPA 1: Detectar marcadores GRANDES (círculos/quadrados) via HSV
         print("  Camada 1: Detectando marcadores destacados (HSV)...")
-        markers = self._detect_highlighted_markers_hsv(roi, x1, y1)
+        markers = markers_future.result()
         print(f"    ✓ {len(markers)} marcadores destacados")
         
         # ETAPA 2: Detectar curvas FINAS via Grid configurável
         print(f"  Camada 2: Detectando curvas via grid {self.grid_divisions}x{self.grid_divisions}...")
-        curves = self._detect_curves_with_grid(roi, x1, y1, grid_size=self.grid_divisions)
+        curves = curves_future.result() if curves_future else np.empty(0, dtype=POINT_DTYPE)
         print(f"    ✓ {len(curves)} pontos em curvas")
         
         # ETAPA 3: Separar por cor E tipo (não misturar marcadores com curvas)
-        all_points = markers + curves
+        all_points = np.concatenate([markers, curves])
         data_points = self._group_by_color_and_type(all_points, x_calib, y_calib)
         
         total = sum(len(pts) for pts in data_points.values())
@@ -56,201 +107,240 @@ class MarkerDetectorV3:
         
         return data_points
     
-    def _detect_highlighted_markers_hsv(self, roi, offset_x, offset_y) -> List[Point]:
+    def _roi_hsv(self, roi, bounds: Tuple[int, int, int, int]) -> np.ndarray:
+        """HSV do ROI, convertido uma vez por frame e reutilizado nas detecções seguintes"""
+        hsv = self._hsv_cache.get(bounds)
+        if hsv is None:
+            hsv = self._hsv_cache[bounds] = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
+        return hsv
+    
+    def _canny(self, bounds: Tuple[int, int, int, int], low: int, high: int) -> np.ndarray:
+        """Canny da escala de cinza no ROI, calculado uma vez por limites e parâmetros"""
+        key = (bounds, low, high)
+        edges = self._canny_cache.get(key)
+        if edges is None:
+            x1, y1, x2, y2 = bounds
+            edges = self._canny_cache[key] = cv2.Canny(self.gray[y1:y2, x1:x2], low, high)
+        return edges
+    
+    def _detect_highlighted_markers_hsv(self, roi, offset_x, offset_y,
+                                        hsv: Optional[np.ndarray] = None) -> np.ndarray:
         """
         Detecta marcadores DESTACADOS (círculos, quadrados) usando HSV + contornos
         Baseado na versão antiga que funcionava bem
+        hsv: ROI já convertido para HSV; se None, converte aqui
         """
-        hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
-        
-        # Ranges de cor em HSV (versão antiga)
-        color_ranges = {
-            'blue': ([100, 50, 50], [130, 255, 255]),
-            'red1': ([0, 50, 50], [10, 255, 255]),      # Vermelho parte 1
-            'red2': ([170, 50, 50], [180, 255, 255]),   # Vermelho parte 2
-            'green': ([40, 50, 50], [80, 255, 255]),
-            'orange': ([10, 100, 100], [25, 255, 255]),  # Laranja
-            'black': ([0, 0, 0], [180, 255, 50])
-        }
-        
-        detected = []
-        
-        for color_name, (lower, upper) in color_ranges.items():
-            mask = cv2.inRange(hsv, np.array(lower), np.array(upper))
-            
-            # Encontrar contornos
-            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if hsv is None:
+            hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
+        
+        h, w = roi.shape[:2]
+        
+        # Cores independentes: inRange + contornos de cada uma em paralelo (ordem preservada)
+        per_color = list(_color_pool.map(
+            lambda bounds: self._marker_centroids(hsv, bounds[0], bounds[1], h, w),
+            _HSV_COLOR_RANGES.values()
+        ))
+        cxs = [cx for centroids in per_color for cx, _ in centroids]
+        cys = [cy for centroids in per_color for _, cy in centroids]
+        
+        # Cores de todos os centróides num único gather
+        return self._points_at(roi, cxs, cys, offset_x, offset_y, 'marker')  # Marcador destacado
+    
+    def _marker_centroids(self, hsv, lower, upper, h, w) -> List[Tuple[int, int]]:
+        """Centróides (cx, cy) dos contornos de uma faixa HSV com área de marcador"""
+        mask = cv2.inRange(hsv, lower, upper)
+        
+        # Encontrar contornos
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        
+        centroids = []
+        for contour in contours:
+            area = cv2.contourArea(contour)
             
-            for contour in contours:
-                area = cv2.contourArea(contour)
-                
-                # Área entre 10 e 1000 pixels (marcadores grandes)
-                if 10 < area < 1000:
-                    M = cv2.moments(contour)
-                    if M['m00'] > 0:
-                        cx = int(M['m10'] / M['m00'])
-                        cy = int(M['m01'] / M['m00'])
-                        
-                        # Verificar se está dentro do ROI
-                        if 0 <= cy < roi.shape[0] and 0 <= cx < roi.shape[1]:
-                            b, g, r = roi[cy, cx]
-                            
-                            # Criar ponto
-                            detected.append(Point(
-                                x=offset_x + cx,
-                                y=offset_y + cy,
-                                color=(int(r), int(g), int(b)),
-                                marker_type='marker'  # Marcador destacado
-                            ))
-        
-        return detected
+            # Área entre 10 e 1000 pixels (marcadores grandes)
+            if 10 < area < 1000:
+                M = cv2.moments(contour)
+                if M['m00'] > 0:
+                    cx = int(M['m10'] / M['m00'])
+                    cy = int(M['m01'] / M['m00'])
+                    
+                    # Verificar se está dentro do ROI
+                    if 0 <= cy < h and 0 <= cx < w:
+                        centroids.append((cx, cy))
+        
+        return centroids
     
-    def _detect_curves_with_grid(self, roi, offset_x, offset_y, grid_size=100) -> List[Point]:
+    def _detect_curves_with_grid(self, roi, offset_x, offset_y, grid_size=100,
+                                 edges: Optional[np.ndarray] = None) -> np.ndarray:
         """
         Grid de 100x100 = 10.000 células detectoras
         Detecta curvas FINAS escaneando cada célula
+        edges: Canny(30, 100) do ROI já calculado; se None, calcula aqui
         """
         h, w = roi.shape[:2]
         cell_h = h / grid_size
         cell_w = w / grid_size
         
         # Criar máscara de bordas para curvas finas
-        gray_roi = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(gray_roi, 30, 100)
+        if edges is None:
+            edges = cv2.Canny(cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY), 30, 100)
         
         # Dilatar levemente para conectar linhas finas
         kernel = np.ones((2, 2), np.uint8)
         edges = cv2.dilate(edges, kernel, iterations=1)
         
-        detected_curve_points = []
-        
-        # Escanear grid 100x100
-        for i in range(grid_size):
-            for j in range(grid_size):
-                # Coordenadas da célula
-                y_start = int(i * cell_h)
-                y_end = int((i + 1) * cell_h)
-                x_start = int(j * cell_w)
-                x_end = int((j + 1) * cell_w)
-                
-                # ROI da célula
-                cell = edges[y_start:y_end, x_start:x_end]
-                
-                # Se há pixels de borda na célula
-                if np.any(cell > 0):
-                    # Centro da célula
-                    cy = (y_start + y_end) // 2
-                    cx = (x_start + x_end) // 2
-                    
-                    if 0 <= cy < roi.shape[0] and 0 <= cx < roi.shape[1]:
-                        b, g, r = roi[cy, cx]
-                        
-                        # Filtrar branco/cinza claro
-                        if not self._is_neutral_color((int(r), int(g), int(b))):
-                            detected_curve_points.append(Point(
-                                x=offset_x + cx,
-                                y=offset_y + cy,
-                                color=(int(r), int(g), int(b)),
-                                marker_type='curve'  # Ponto de curva
-                            ))
-        
-        return detected_curve_points
+        # Limites das células (mesmos int() da varredura célula a célula)
+        y_start = (np.arange(grid_size) * cell_h).astype(np.intp)
+        y_end = (np.arange(1, grid_size + 1) * cell_h).astype(np.intp)
+        x_start = (np.arange(grid_size) * cell_w).astype(np.intp)
+        x_end = (np.arange(1, grid_size + 1) * cell_w).astype(np.intp)
+        
+        # Escanear grid 100x100 de uma vez: imagem integral dá a contagem de
+        # pixels de borda de cada célula com 4 leituras, sem laço em Python
+        integral = cv2.integral((edges > 0).view(np.uint8))
+        counts = (integral[y_end[:, None], x_end[None, :]] - integral[y_start[:, None], x_end[None, :]]
+                  - integral[y_end[:, None], x_start[None, :]] + integral[y_start[:, None], x_start[None, :]])
+        
+        # Se há pixels de borda na célula (ordem linha a linha, como na varredura)
+        rows, cols = np.nonzero(counts > 0)
+        
+        # Centro da célula
+        cys = (y_start[rows] + y_end[rows]) // 2
+        cxs = (x_start[cols] + x_end[cols]) // 2
+        inside = (cys >= 0) & (cys < roi.shape[0]) & (cxs >= 0) & (cxs < roi.shape[1])
+        cxs, cys = cxs[inside], cys[inside]
+        
+        # Filtrar branco/cinza claro
+        return self._points_at(roi, cxs, cys, offset_x, offset_y, 'curve', skip_neutral=True)  # Ponto de curva
+    
+    def _points_at(self, roi, cxs: List[int], cys: List[int], offset_x, offset_y,
+                   marker_type: str, skip_neutral: bool = False) -> np.ndarray:
+        """
+        Lê as cores (BGR) de todas as posições de uma vez
+        Retorna os pontos como array estruturado POINT_DTYPE (sem objetos Point)
+        """
+        cxs = np.asarray(cxs, dtype=np.intp)
+        cys = np.asarray(cys, dtype=np.intp)
+        
+        bgr = roi[cys, cxs].reshape(-1, 3)
+        rgb = bgr[:, ::-1].astype(np.int16)
+        
+        if skip_neutral:
+            keep = ~self._is_neutral_color(rgb)
+            cxs, cys, bgr = cxs[keep], cys[keep], bgr[keep]
+        
+        points = np.empty(len(cxs), dtype=POINT_DTYPE)
+        points['x'] = offset_x + cxs
+        points['y'] = offset_y + cys
+        points['r'] = bgr[:, 2]
+        points['g'] = bgr[:, 1]
+        points['b'] = bgr[:, 0]
+        points['marker'] = MARKER_TYPES.index(marker_type)
+        return points
     
-    def _is_neutral_color(self, rgb: Tuple[int, int, int]) -> bool:
-        """Filtra cores neutras (branco/cinza)"""
-        r, g, b = rgb
+    def _is_neutral_color(self, rgb: np.ndarray) -> np.ndarray:
+        """Filtra cores neutras (branco/cinza), vetorizado sobre (N, 3) RGB"""
+        r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
         
         # Branco
-        if r > 240 and g > 240 and b > 240:
-            return True
+        white = (r > 240) & (g > 240) & (b > 240)
         
-        # Cinza (baixa saturação)
-        avg = (r + g + b) / 3
-        if avg > 200 and max(abs(r - avg), abs(g - avg), abs(b - avg)) < 15:
-            return True
+        # Cinza (baixa saturação): média > 200 e desvio máximo da média < 15,
+        # em inteiros sobre a soma (3*média), sem divisão nem abs
+        total = r + g + b
+        spread3 = np.maximum(3 * np.maximum(np.maximum(r, g), b) - total,
+                             total - 3 * np.minimum(np.minimum(r, g), b))
+        gray = (total > 600) & (spread3 < 45)
         
-        return False
+        return white | gray
     
-    def _group_by_color_and_type(self, points: List[Point], 
+    def _group_by_color_and_type(self, points: np.ndarray, 
                                    x_calib: AxisCalibration, 
                                    y_calib: AxisCalibration) -> Dict:
         """
         Agrupa pontos por COR + TIPO
         Marcadores e curvas da mesma cor ficam em séries SEPARADAS
+        
+        Returns:
+            {série: DataFrame com colunas x, y, type}, cada série ordenada por x
         """
-        data_points = defaultdict(list)
+        if not len(points):
+            return {}
         
-        for point in points:
-            # Classificar cor
-            color_name = self._classify_color(point.color)
-            
-            # Chave: cor + tipo (separar marcadores de curvas)
-            if point.marker_type == 'marker':
-                series_key = f"{color_name}_points"
-            else:  # curve
-                series_key = f"{color_name}_line"
-            
-            # Normalizar coordenadas (0-1)
-            norm_x = (point.x - self.frame.bottom_left[0]) / self.frame.width
-            norm_y = 1.0 - (point.y - self.frame.top_left[1]) / self.frame.height
-            
-            # Aplicar calibração
-            real_x = self._pixel_to_real_x(norm_x, x_calib)
-            real_y = self._pixel_to_real_y(norm_y, y_calib)
-            
-            data_points[series_key].append({
-                'x': real_x,
-                'y': real_y,
-                'type': point.marker_type
-            })
+        # Colunas (SoA) do array estruturado de pontos
+        px = points['x'].astype(np.float64)
+        py = points['y'].astype(np.float64)
+        colors = np.stack([points['r'], points['g'], points['b']], axis=1).astype(np.int16)
+        types = _MARKER_NAMES[points['marker']]
         
-        return dict(data_points)
-    
-    def _classify_color(self, rgb: Tuple[int, int, int]) -> str:
-        """Classificação robusta de cores"""
-        r, g, b = rgb
+        # Chave: cor + tipo (separar marcadores de curvas), como inteiro
+        # id_cor*2 + marcador; o nome ('Red_points', ...) só é montado por série
+        keys = self._classify_colors(colors) * 2 + (points['marker'] == _MARKER_CODE)
+        
+        # Normalizar coordenadas (0-1) e aplicar calibração
+        norm_x = (px - self.frame.bottom_left[0]) / self.frame.width
+        norm_y = 1.0 - (py - self.frame.top_left[1]) / self.frame.height
+        real_x = self._pixel_to_real_x(norm_x, x_calib)
+        real_y = self._pixel_to_real_y(norm_y, y_calib)
         
-        # Preto (prioridade)
-        if max(r, g, b) < 80:
-            return 'Black'
+        # Séries na ordem da primeira aparição; pontos na ordem de detecção.
+        # Um único argsort estável deixa cada série contígua: fatias, sem máscara por série
+        uniq, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(inverse, minlength=len(uniq)))))
+        
+        data_points = {}
+        for k in np.argsort(first):
+            idx = order[bounds[k]:bounds[k + 1]]
+            color_id, is_marker = divmod(int(uniq[k]), 2)
+            name = _COLOR_NAMES[color_id] + ('_points' if is_marker else '_line')
+            data_points[name] = pd.DataFrame({
+                'x': real_x[idx], 'y': real_y[idx], 'type': types[idx]
+            }).sort_values('x', kind='stable', ignore_index=True)
+        
+        return data_points
+    
+    def _classify_colors(self, colors: np.ndarray) -> np.ndarray:
+        """
+        Classificação robusta de cores, vetorizada sobre (N, 3) RGB
+        Mesma cascata de regras da versão ponto a ponto: só cores saturadas
+        (saturação > 0.3) viram Orange/Red/Blue/Green; o resto é Black
+        Retorna ids de classe (índices em _COLOR_NAMES)
+        """
+        r, g, b = (colors[:, i].astype(np.int16) for i in range(3))
+        max_val = np.maximum(np.maximum(r, g), b)
+        min_val = np.minimum(np.minimum(r, g), b)
         
         # Calcular saturação
-        max_val = max(r, g, b)
-        min_val = min(r, g, b)
-        saturation = (max_val - min_val) / max_val if max_val > 0 else 0
-        
-        # Cores saturadas
-        if saturation > 0.3:
-            if r == max_val:
-                # Verificar se é laranja vs vermelho
-                if g > 100 and g > b:
-                    return 'Orange'
-                elif r > 150:
-                    return 'Red'
-            elif b == max_val and b > 150:
-                return 'Blue'
-            elif g == max_val and g > 150:
-                return 'Green'
-        
-        # Cinza escuro → Preto
-        if max_val < 180 and saturation < 0.2:
-            return 'Black'
-        
-        # Default
-        return 'Black'
+        with np.errstate(divide='ignore', invalid='ignore'):
+            saturation = np.where(max_val > 0, (max_val - min_val) / max_val, 0.0)
+        
+        # Preto (prioridade) exclui o resto; cinza escuro e default também são Black
+        saturated = (max_val >= 80) & (saturation > 0.3)
+        r_max = r == max_val
+        b_max = ~r_max & (b == max_val)
+        g_max = ~r_max & ~b_max & (g == max_val)
+        
+        # Verificar se é laranja vs vermelho
+        orange = saturated & r_max & (g > 100) & (g > b)
+        red = saturated & r_max & ~orange & (r > 150)
+        blue = saturated & b_max & (b > 150)
+        green = saturated & g_max & (g > 150)
+        
+        return np.select([orange, red, blue, green], [1, 2, 3, 4], default=0)
     
-    def _pixel_to_real_x(self, normalized_x: float, calib: AxisCalibration) -> float:
+    def _pixel_to_real_x(self, normalized_x: np.ndarray, calib: AxisCalibration) -> np.ndarray:
         """Converte X normalizado para valor real (com suporte a zero)"""
         if calib.zero_position is not None:
-            if normalized_x < calib.zero_position:
-                ratio = normalized_x / calib.zero_position
-                return calib.min_value * ratio
-            else:
-                ratio = (normalized_x - calib.zero_position) / (1.0 - calib.zero_position)
-                return calib.max_value * ratio
+            zero = calib.zero_position
+            return np.where(
+                normalized_x < zero,
+                calib.min_value * (normalized_x / zero),
+                calib.max_value * ((normalized_x - zero) / (1.0 - zero))
+            )
         else:
             return calib.min_value + normalized_x * (calib.max_value - calib.min_value)
     
-    def _pixel_to_real_y(self, normalized_y: float, calib: AxisCalibration) -> float:
+    def _pixel_to_real_y(self, normalized_y: np.ndarray, calib: AxisCalibration) -> np.ndarray:
         """Converte Y normalizado para valor real"""
-        return calib.min_value + normalized_y * (calib.max_value - calib.min_value)
\ No newline at end of file
+        return calib.min_value + normalized_y * (calib.max_value - calib.min_value)
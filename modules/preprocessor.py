@@ -4,17 +4,56 @@ Remove legendas, caixas de texto e outros elementos que interferem na detecção
 """
 import cv2
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 from typing import List, Tuple, Optional
 
 
+# Elementos estruturantes retangulares da dilatação das bordas (fortes 3x3, suaves 2x2),
+# criados uma vez; MORPH_RECT habilita o caminho separável do OpenCV
+_KERNEL_3 = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+_KERNEL_2 = cv2.getStructuringElement(cv2.MORPH_RECT, (2, 2))
+
+# Limiares (baixo, alto) do Canny das bordas fortes e das suaves (contorno fino)
+_CANNY_STRONG = (50, 150)
+_CANNY_SOFT = (20, 80)
+
+# Raio do inpainting TELEA (px): pixels conhecidos mais distantes que isso da
+# máscara não influenciam o preenchimento
+_INPAINT_RADIUS = 7
+
+# Pool persistente para as três passadas de detecção de legendas (o OpenCV libera o GIL)
+_pass_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix='legend-pass')
+
+
+def _edge_contours(dx: np.ndarray, dy: np.ndarray, low: int, high: int, kernel: np.ndarray) -> tuple:
+    """Contornos externos do Canny (a partir dos gradientes) dilatado pelo kernel"""
+    edges = cv2.Canny(dx, dy, low, high)
+    edges = cv2.dilate(edges, kernel, iterations=1)
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return contours
+
+
+def _text_contours(gray: np.ndarray) -> tuple:
+    """Contornos externos dos componentes escuros (binarização de Otsu invertida)"""
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return contours
+
+
 class ImagePreprocessor:
     """Remove automaticamente legendas e caixas de texto do gráfico"""
     
     def __init__(self, img: np.ndarray):
         self.img = img
         self.h, self.w = img.shape[:2]
-        self.gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         self.legend_boxes = []
+        self._integral: Optional[np.ndarray] = None
+    
+    @cached_property
+    def gray(self) -> np.ndarray:
+        """Escala de cinza, convertida só quando a detecção de legendas a usa"""
+        return cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY)
     
     def remove_legends(self, ask_user: bool = False) -> Tuple[np.ndarray, List[Tuple]]:
         """
@@ -59,12 +98,19 @@ class ImagePreprocessor:
         
         print(f"    [DEBUG] Tamanho da imagem: {self.w}x{self.h}")
         
-        # Estratégia 1: Detectar retângulos COM bordas FORTES
-        edges = cv2.Canny(self.gray, 50, 150)
-        kernel = np.ones((3, 3), np.uint8)
-        edges = cv2.dilate(edges, kernel, iterations=1)
+        # Gradientes Sobel 3x3 calculados uma vez: as duas passadas de Canny
+        # (fortes e suaves) só diferem nos limiares da histerese
+        dx = cv2.Sobel(self.gray, cv2.CV_16S, 1, 0, ksize=3, borderType=cv2.BORDER_REPLICATE)
+        dy = cv2.Sobel(self.gray, cv2.CV_16S, 0, 1, ksize=3, borderType=cv2.BORDER_REPLICATE)
         
-        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # As três passadas são independentes: contornos calculados em paralelo,
+        # filtragem (e os prints) na ordem de sempre
+        strong_future = _pass_pool.submit(_edge_contours, dx, dy, *_CANNY_STRONG, _KERNEL_3)
+        soft_future = _pass_pool.submit(_edge_contours, dx, dy, *_CANNY_SOFT, _KERNEL_2)  # Thresholds mais baixos
+        text_future = _pass_pool.submit(_text_contours, self.gray)
+        
+        # Estratégia 1: Detectar retângulos COM bordas FORTES
+        contours = strong_future.result()
         print(f"    [DEBUG] Estratégia 1 (bordas fortes): {len(contours)} contornos")
         
         count_1 = 0
@@ -79,21 +125,15 @@ class ImagePreprocessor:
                 x + w < self.w - 50 and 
                 y + h < self.h - 50):
                 
-                roi = self.gray[y:y+h, x:x+w]
-                if roi.size > 0:
-                    mean_intensity = np.mean(roi)
-                    if mean_intensity > 180:
-                        boxes.append((x, y, w, h))
-                        count_1 += 1
+                mean_intensity = self._mean_intensity(x, y, w, h)
+                if mean_intensity > 180:
+                    boxes.append((x, y, w, h))
+                    count_1 += 1
         
         print(f"    [DEBUG] Estratégia 1: {count_1} caixas detectadas")
         
         # Estratégia 1B: Detectar bordas SUAVES (caixas com contorno fino)
-        edges_soft = cv2.Canny(self.gray, 20, 80)  # Thresholds mais baixos
-        kernel_soft = np.ones((2, 2), np.uint8)
-        edges_soft = cv2.dilate(edges_soft, kernel_soft, iterations=1)
-        
-        contours_soft, _ = cv2.findContours(edges_soft, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours_soft = soft_future.result()
         print(f"    [DEBUG] Estratégia 1B (bordas suaves): {len(contours_soft)} contornos")
         
         count_1b = 0
@@ -109,29 +149,19 @@ class ImagePreprocessor:
                 x + w < self.w - 50 and 
                 y + h < self.h - 50):
                 
-                roi = self.gray[y:y+h, x:x+w]
-                if roi.size > 0:
-                    mean_intensity = np.mean(roi)
-                    # Verificar se tem fundo claro + texto escuro
-                    if mean_intensity > 170:
-                        # Verificar se não é duplicata
-                        overlap = False
-                        for bx, by, bw, bh in boxes:
-                            if self._boxes_overlap((x, y, w, h), (bx, by, bw, bh), threshold=0.5):
-                                overlap = True
-                                break
-                        
-                        if not overlap:
-                            boxes.append((x, y, w, h))
-                            count_1b += 1
-                            print(f"    [DEBUG] Caixa suave: x={x}, y={y}, w={w}, h={h}, area={area}, aspect={aspect:.2f}, mean={mean_intensity:.1f}")
+                mean_intensity = self._mean_intensity(x, y, w, h)
+                # Verificar se tem fundo claro + texto escuro
+                if mean_intensity > 170:
+                    # Verificar se não é duplicata
+                    if not self._overlaps_any((x, y, w, h), boxes, threshold=0.5):
+                        boxes.append((x, y, w, h))
+                        count_1b += 1
+                        print(f"    [DEBUG] Caixa suave: x={x}, y={y}, w={w}, h={h}, area={area}, aspect={aspect:.2f}, mean={mean_intensity:.1f}")
         
         print(f"    [DEBUG] Estratégia 1B: {count_1b} caixas detectadas")
         
         # Estratégia 2: Detectar regiões de TEXTO SEM CAIXA
-        _, binary = cv2.threshold(self.gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-        
-        contours_text, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours_text = text_future.result()
         print(f"    [DEBUG] Estratégia 2 (texto): {len(contours_text)} componentes de texto")
         
         text_regions = []
@@ -163,13 +193,7 @@ class ImagePreprocessor:
                     block_y + block_h < self.h - 50):
                     
                     # Verificar se já não está em boxes
-                    overlap = False
-                    for bx, by, bw, bh in boxes:
-                        if self._boxes_overlap((block_x, block_y, block_w, block_h), (bx, by, bw, bh)):
-                            overlap = True
-                            break
-                    
-                    if not overlap:
+                    if not self._overlaps_any((block_x, block_y, block_w, block_h), boxes):
                         boxes.append((block_x, block_y, block_w, block_h))
                         count_2 += 1
                         print(f"    [DEBUG] ✓ Bloco aceito")
@@ -183,6 +207,17 @@ class ImagePreprocessor:
         print(f"    [DEBUG] TOTAL: {len(boxes)} caixas detectadas")
         return boxes
     
+    def _mean_intensity(self, x: int, y: int, w: int, h: int) -> float:
+        """
+        Média de cinza da caixa em O(1) pela imagem integral (soma exata em
+        float64, calculada uma vez na primeira caixa candidata)
+        """
+        if self._integral is None:
+            self._integral = cv2.integral(self.gray, sdepth=cv2.CV_64F)
+        ii = self._integral
+        total = ii[y + h, x + w] - ii[y, x + w] - ii[y + h, x] + ii[y, x]
+        return total / (w * h)
+    
     def _cluster_text_regions(self, regions: List[Tuple]) -> List[Tuple]:
         """Agrupa regiões de texto próximas em blocos - MELHORADO"""
         if not regions:
@@ -192,14 +227,16 @@ class ImagePreprocessor:
         regions = sorted(regions, key=lambda r: (r[1], r[0]))
         
         blocks = []
-        current_block = list(regions[0])  # [x, y, w, h]
+        # Bloco atual como cantos escalares (x1, y1, x2, y2), sem lista a remontar
+        x, y, w, h = regions[0]
+        bx1, by1, bx2, by2 = x, y, x + w, y + h
         
         for x, y, w, h in regions[1:]:
             # Calcular distâncias
             # Distância horizontal: da direita do bloco atual até o novo elemento
-            dist_x = x - (current_block[0] + current_block[2])
+            dist_x = x - bx2
             # Distância vertical
-            dist_y = abs(y - current_block[1])
+            dist_y = abs(y - by1)
             
             # Critérios mais permissivos para capturar linhas múltiplas
             # Se está na mesma linha OU linha abaixo próxima
@@ -207,18 +244,17 @@ class ImagePreprocessor:
                 (dist_y < 50 and abs(dist_x) < 100)):  # Linha abaixo, alinhado
                 
                 # Expandir bloco atual
-                new_x = min(current_block[0], x)
-                new_y = min(current_block[1], y)
-                new_x2 = max(current_block[0] + current_block[2], x + w)
-                new_y2 = max(current_block[1] + current_block[3], y + h)
-                current_block = [new_x, new_y, new_x2 - new_x, new_y2 - new_y]
+                bx1 = min(bx1, x)
+                by1 = min(by1, y)
+                bx2 = max(bx2, x + w)
+                by2 = max(by2, y + h)
             else:
                 # Salvar bloco atual e começar novo
-                blocks.append(tuple(current_block))
-                current_block = [x, y, w, h]
+                blocks.append((bx1, by1, bx2 - bx1, by2 - by1))
+                bx1, by1, bx2, by2 = x, y, x + w, y + h
         
         # Adicionar último bloco
-        blocks.append(tuple(current_block))
+        blocks.append((bx1, by1, bx2 - bx1, by2 - by1))
         
         # Expandir blocos em 10px em todas direções (margem)
         expanded_blocks = []
@@ -253,32 +289,56 @@ class ImagePreprocessor:
         
         return False
     
-    def _filter_internal_boxes(self, boxes: List[Tuple]) -> List[Tuple]:
-        """Filtra apenas caixas que estão DENTRO do gráfico (não nos eixos)"""
+    def _overlaps_any(self, box: Tuple, boxes: List[Tuple], threshold: float = 0.3) -> bool:
+        """
+        Mesmo teste de _boxes_overlap contra todas as caixas aceitas de uma vez
+        (interseção calculada em bloco com NumPy, sem laço em Python)
+        """
+        if not boxes:
+            return False
+        
+        x, y, w, h = box
+        b = np.asarray(boxes)
+        bx, by, bw, bh = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+        
+        # Interseção (zero quando não há sobreposição)
+        inter_w = np.clip(np.minimum(x + w, bx + bw) - np.maximum(x, bx), 0, None)
+        inter_h = np.clip(np.minimum(y + h, by + bh) - np.maximum(y, by), 0, None)
+        
+        # Se interseção > threshold de qualquer caixa
+        return bool(np.any(inter_w * inter_h > threshold * np.minimum(w * h, bw * bh)))
+    
+    @cached_property
+    def _plot_margins(self) -> Tuple[int, int, int]:
+        """Margens (lateral, superior, inferior) da região estimada do gráfico"""
         # Estimar região do gráfico (área central, excluindo margens)
         margin_x = int(0.15 * self.w)  # 15% de margem lateral
         margin_y_top = int(0.1 * self.h)  # 10% margem superior
         margin_y_bottom = int(0.2 * self.h)  # 20% margem inferior
+        return margin_x, margin_y_top, margin_y_bottom
+    
+    def _filter_internal_boxes(self, boxes: List[Tuple]) -> List[Tuple]:
+        """Filtra apenas caixas que estão DENTRO do gráfico (não nos eixos)"""
+        if not boxes:
+            return []
         
-        internal_boxes = []
+        margin_x, margin_y_top, margin_y_bottom = self._plot_margins
         
-        for x, y, w, h in boxes:
-            cx = x + w // 2  # Centro da caixa
-            cy = y + h // 2
-            
-            # Verificar se está na área central (dentro do gráfico)
-            if (margin_x < cx < self.w - margin_x and
-                margin_y_top < cy < self.h - margin_y_bottom):
-                internal_boxes.append((x, y, w, h))
+        b = np.asarray(boxes)
+        cx = b[:, 0] + b[:, 2] // 2  # Centro da caixa
+        cy = b[:, 1] + b[:, 3] // 2
         
-        return internal_boxes
+        # Verificar se está na área central (dentro do gráfico), todas de uma vez
+        inside = ((margin_x < cx) & (cx < self.w - margin_x) &
+                  (margin_y_top < cy) & (cy < self.h - margin_y_bottom))
+        
+        return [tuple(box) for box in b[inside].tolist()]
     
     def _inpaint_boxes(self, img: np.ndarray, boxes: List[Tuple]) -> np.ndarray:
         """Remove caixas usando inpainting (preenchimento inteligente)"""
-        cleaned = img.copy()
-        
         # Criar máscara de regiões a serem removidas
         mask = np.zeros((self.h, self.w), dtype=np.uint8)
+        rects = []
         
         for x, y, w, h in boxes:
             # Expandir um pouco a área (margem de 5px)
@@ -287,13 +347,60 @@ class ImagePreprocessor:
             x2 = min(self.w, x + w + 5)
             y2 = min(self.h, y + h + 5)
             
-            mask[y1:y2, x1:x2] = 255
-        
-        # Inpainting: preenche a região com base no entorno
-        cleaned = cv2.inpaint(cleaned, mask, inpaintRadius=7, flags=cv2.INPAINT_TELEA)
+            # cv2.rectangle preenchido inclui o canto final: (x2-1, y2-1) equivale à fatia
+            if x2 > x1 and y2 > y1:
+                cv2.rectangle(mask, (x1, y1), (x2 - 1, y2 - 1), 255, thickness=-1)
+            rects.append((x1, y1, x2, y2))
+        
+        # Caixas isoladas sobre fundo de uma cor só (ex: branco): o TELEA devolveria
+        # essa mesma cor, então preenche direto e tira a caixa da máscara do inpainting
+        cleaned = img
+        residual = mask
+        for i, (x1, y1, x2, y2) in enumerate(rects):
+            fill = self._uniform_surround(img, mask, rects, i)
+            if fill is not None:
+                if cleaned is img:
+                    cleaned, residual = img.copy(), mask.copy()
+                cleaned[y1:y2, x1:x2] = fill
+                residual[y1:y2, x1:x2] = 0
+        
+        if not residual.any():
+            return cleaned
+        
+        # Inpainting: preenche a região com base no entorno (devolve nova imagem;
+        # img não é alterada, então não precisa de cópia prévia)
+        cleaned = cv2.inpaint(cleaned, residual, inpaintRadius=_INPAINT_RADIUS, flags=cv2.INPAINT_TELEA)
         
         return cleaned
     
+    def _uniform_surround(self, img: np.ndarray, mask: np.ndarray,
+                          rects: List[Tuple], i: int) -> Optional[np.ndarray]:
+        """
+        Cor única do anel (raio do TELEA + 1 px) ao redor da caixa i, ou None se o
+        anel tem mais de uma cor ou encosta no anel de outra caixa (o inpainting
+        de uma influenciaria a outra)
+        Só vale para canais 0 ou 255: nos demais valores o arredondamento do
+        TELEA pode devolver ±1 mesmo com o entorno uniforme
+        """
+        pad = _INPAINT_RADIUS + 1
+        x1, y1, x2, y2 = rects[i]
+        
+        for j, (ox1, oy1, ox2, oy2) in enumerate(rects):
+            if (j != i and ox1 - pad < x2 + pad and x1 - pad < ox2 + pad and
+                    oy1 - pad < y2 + pad and y1 - pad < oy2 + pad):
+                return None
+        
+        rx1, ry1 = max(0, x1 - pad), max(0, y1 - pad)
+        rx2, ry2 = min(self.w, x2 + pad), min(self.h, y2 + pad)
+        ring = img[ry1:ry2, rx1:rx2][mask[ry1:ry2, rx1:rx2] == 0]
+        
+        if len(ring) == 0 or not (ring == ring[0]).all():
+            return None
+        color = ring[0]
+        if not ((color == 0) | (color == 255)).all():
+            return None
+        return color
+    
     def visualize_detected_boxes(self, boxes: List[Tuple]) -> np.ndarray:
         """Cria visualização das caixas detectadas (para debug/confirmação)"""
         vis = self.img.copy()
@@ -320,9 +427,8 @@ def preprocess_image(img: np.ndarray, remove_legends: bool = True,
         - Imagem processada
         - Dict com informações: {'legend_boxes': [...], 'cleaned': bool}
     """
-    preprocessor = ImagePreprocessor(img)
-    
     if remove_legends:
+        preprocessor = ImagePreprocessor(img)
         cleaned_img, boxes = preprocessor.remove_legends(ask_user=ask_user)
         
         info = {